@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+""" How much memory does writing a laser job take? Runs a unit of a generated drawing - a grid of small zigzags,
+big enough to be split into tiles - through a laser process end to end (loading, cleaning, code generation and
+write_file), and reports the peak traced by tracemalloc. Needs pewpew. Run from anywhere:
+python benchmarks/laser_memory.py [process] [size in mm] """
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def drawing(path, size):
+    import ezdxf
+    import numpy as np
+    doc = ezdxf.new()
+    doc.layers.add('1')
+    msp = doc.modelspace()
+    for x in np.arange(2, size - 2, 4.0):
+        for y in np.arange(2, size - 2, 4.0):
+            msp.add_lwpolyline([(x + 3 * t, y + 1.5 * (k % 2)) for k, t in enumerate(np.linspace(0, 1, 11))],
+                               dxfattribs = {'layer' : '1'})
+    doc.saveas(path)
+
+
+def main(process = 'laser.StainlessStencil', size = 200.0):
+    import burin.pipeline
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'grid.dxf')
+        drawing(source, size)
+        output = os.path.join(directory, 'out')
+        os.mkdir(output)
+        pipeline = burin.pipeline.Pipeline.start(source, process, output)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        pipeline.run('1', force = True)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        jobs = [f for f in os.listdir(output) if f.endswith('.laser')]
+        print(f"{process}: {len(jobs)} job(s), peak {peak / 1e6:.1f} MB, {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:2], *[float(x) for x in sys.argv[2:3]]))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+""" How long does run_burin take to start? Times 'run_burin --help' and 'run_burin list' (which only
+needs state.json) as subprocesses, and checks that importing the CLI doesn't drag in the geometry
+libraries. Run from anywhere: python benchmarks/startup.py [runs] """
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'run_burin.py')
+HEAVY = ['numpy', 'scipy', 'ezdxf', 'burin.dxfloader', 'burin.path']
+
+
+def time_command(args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT] + args, check = True, stdout = subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times)
+
+
+def heavy_imports():
+    check = f"import sys; sys.path.insert(0, {ROOT!r}); import run_burin; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', check], check = True, capture_output = True, text = True)
+    return [x for x in out.stdout.strip().split(',') if x]
+
+
+def main(runs = 20):
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'state.json'), 'w') as f:
+            json.dump({'process' : 'processes.SimpleProcess', 'units' : [{'name' : 'all'}], 'parameters' : {}, 'stage' : {'all' : 0}}, f)
+
+        baseline = [sys.executable, '-c', 'pass']
+        start = time.perf_counter()
+        for _ in range(runs):
+            subprocess.run(baseline, check = True)
+        interpreter = (time.perf_counter() - start) / runs
+        
+        print(f"{'command':<12} {'median (ms)':>12} {'min (ms)':>10}")
+        print(f"{'python':<12} {1000 * interpreter:>12.1f} {'':>10}")
+        for name, args in [('--help', ['--help']), ('list', ['list', directory])]:
+            median, best = time_command(args, runs)
+            print(f"{name:<12} {1000 * median:>12.1f} {1000 * best:>10.1f}")
+
+    loaded = heavy_imports()
+    if loaded:
+        print(f"Importing run_burin also imports: {', '.join(loaded)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
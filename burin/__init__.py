@@ -0,0 +1,8 @@
+""" Turning dxf drawings into plotter and laser jobs. The pipeline pulls in the geometry libraries,
+so it's only imported once something asks for it. """
+
+def __getattr__(name):
+    if name in ('Pipeline', 'PipelineError'):
+        import burin.pipeline
+        return getattr(burin.pipeline, name)
+    raise AttributeError(f"module 'burin' has no attribute '{name}'")
@@ -0,0 +1,170 @@
+""" Replace runs of closely spaced points with arcs and longer straight moves, to within a tolerance.
+
+Flattened curves reach the code generators as thousands of tiny line segments, which controllers crawl through
+with their look-ahead. Here we walk along a polyline, greedily taking the longest run of points that stays within
+the tolerance of either a straight line or a circular arc through its ends and middle, checking the midpoints of
+the original chords as well as the points themselves. Arcs come out as ordinary Arc segments, so every code
+generator that already handles them gets G2/G3 for free.
+
+That search costs a few NumPy calls per step, so it isn't run across vertices that can't be inside any run: sharp
+corners, which are too far off the line between their neighbours, and turn too tightly for the circle through
+them and their neighbours to stay within tolerance of the chords (see turns). Those are found for the whole
+polyline at once, and the search starts over at each - on geometry with nothing to fit, that's nearly all the
+work there is.
+
+Consecutive arcs are fitted independently, so a curve that changes direction becomes arcs that meet end to end,
+each within tolerance, rather than biarcs with matching tangents. """
+
+import numpy as np
+
+import burin.types
+
+
+def circle(a, b, c):
+    """ The center of the circle through three points, or None if they're (nearly) collinear """
+    (ax, ay), (bx, by), (cx, cy) = a, b, c
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    a2, b2, c2 = ax * ax + ay * ay, bx * bx + by * by, cx * cx + cy * cy
+    return np.array([(a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d,
+                     (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d])
+
+def line_fits(pts, tolerance):
+    """ Do all of the points lie within tolerance of the segment between the first and the last? """
+    start, delta = pts[0], pts[-1] - pts[0]
+    length = np.sqrt(delta @ delta)
+    rel = pts[1:-1] - start
+    if length < tolerance:
+        return bool(np.all(np.einsum('ij,ij->i', rel, rel) <= tolerance * tolerance))
+    along = rel @ delta / length
+    across = np.abs(rel[:,0] * delta[1] - rel[:,1] * delta[0]) / length
+    return bool(np.all(across <= tolerance) and np.all(along >= -tolerance) and np.all(along <= length + tolerance))
+
+def arc_fits(pts, tolerance, max_radius):
+    """ If the points (and the midpoints between them) lie within tolerance of a circular arc through the first,
+    middle, and last points, sweeping steadily in one direction, returns (center, clockwise). Otherwise, None. """
+    center = circle(pts[0], pts[len(pts) // 2], pts[-1])
+    if center is None:
+        return None
+    radial = pts - center
+    radius = np.sqrt(radial[0] @ radial[0])
+    if radius > max_radius:
+        return None
+
+    mids = 0.5 * (pts[1:] + pts[:-1]) - center
+    if (np.any(np.abs(np.sqrt(np.einsum('ij,ij->i', radial, radial)) - radius) > tolerance) or
+        np.any(np.abs(np.sqrt(np.einsum('ij,ij->i', mids, mids)) - radius) > tolerance)):
+        return None
+
+    a, b = radial[:-1], radial[1:]
+    sweep = np.arctan2(a[:,0] * b[:,1] - a[:,1] * b[:,0], np.einsum('ij,ij->i', a, b))
+    if not (np.all(sweep >= 0) or np.all(sweep <= 0)):
+        return None
+    # No chord should skip around the circle, and the whole arc should be less than a full turn
+    if np.any(np.abs(sweep) > 0.5 * np.pi) or abs(sweep.sum()) > 1.9 * np.pi:
+        return None
+    return center, bool(sweep.sum() < 0)
+
+def turns(pts):
+    """ For each of pts[1:-1], how far it is from the line between its neighbours, how far the middle of the
+    longer chord either side of it is from the circle through it and its neighbours, and whether the chords turn
+    by less than a right angle - the deviations a line or arc through the three points would have """
+    a, b = np.diff(pts[:-1], axis = 0), np.diff(pts[1:], axis = 0)
+    cross = np.abs(a[:,0] * b[:,1] - a[:,1] * b[:,0])
+    la, lb = np.sqrt(np.einsum('ij,ij->i', a, a)), np.sqrt(np.einsum('ij,ij->i', b, b))
+    span = np.sqrt(np.einsum('ij,ij->i', a + b, a + b))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        off_line = cross / span
+        radius = la * lb * span / (2 * cross)
+        half = 0.5 * np.maximum(la, lb)
+        sagitta = radius - np.sqrt(np.maximum(radius * radius - half * half, 0.0))
+    return off_line, sagitta, np.einsum('ij,ij->i', a, b) >= 0
+
+def longest(fits, n, i, shortest):
+    """ The furthest index j (at least i + shortest - 1) such that fits(i, j), or None. Expands exponentially
+    then bisects, so it only checks O(log n) candidates. """
+    j = i + shortest - 1
+    if j >= n or not fits(i, j):
+        return None
+    good, step = j, shortest - 1
+    while True:
+        step *= 2
+        j = min(i + step, n - 1)
+        if j == good or not fits(i, j):
+            break
+        good = j
+    bad = j if j != good else n
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if fits(i, mid):
+            good = mid
+        else:
+            bad = mid
+    return good
+
+def fit_polyline(coords, tolerance, max_radius = 1e4):
+    """ A list of Polylines and Arcs that follows coords to within tolerance """
+    pts = np.asarray(coords, dtype = float)[:,0:2]
+    n = len(pts)
+    if n < 3:
+        return [burin.types.Polyline(pts)]
+
+    arcs = {}
+    def fits_arc(i, j):
+        fit = arc_fits(pts[i:j + 1], tolerance, max_radius)
+        if fit is not None:
+            arcs[(i, j)] = fit
+        return fit is not None
+
+    # Corners can't be inside any run - allowing twice the tolerance either way, as a fitted line or circle needn't
+    # pass through their neighbours. Chords turning by more than a right angle never fit (see arc_fits).
+    off_line, sagitta, forward = turns(pts)
+    corner = ~((off_line <= 2 * tolerance) | (forward & (sagitta <= 2 * tolerance)))
+    # Every run ends at the next corner (or the end) - and where corners come one after another, there's nothing
+    # to search for until the last of them
+    stops = np.append(np.flatnonzero(corner) + 1, n - 1)
+    chained = np.flatnonzero(np.diff(stops) != 1)
+    last = np.append(chained, len(stops) - 1)[np.searchsorted(chained, np.arange(len(stops)))]
+
+    ret, vertices, i = [], [0], 0
+    while i < n - 1:
+        k = np.searchsorted(stops, i, side = 'right')
+        if stops[k] == i + 1:
+            vertices.extend(range(i + 1, stops[last[k]] + 1))
+            i = int(stops[last[k]])
+            continue
+        end = stops[k] + 1
+        if end == i + 3 and off_line[i] > tolerance and not (forward[i] and sagitta[i] <= tolerance):
+            # A lone vertex between corners, and neither a line nor an arc through all three fits
+            vertices.append(i + 1)
+            i += 1
+            continue
+        line = longest(lambda i, j: line_fits(pts[i:j + 1], tolerance), end, i, 2)
+        arc = longest(fits_arc, end, i, 3)
+        if arc is not None and arc > line:
+            if len(vertices) > 1:
+                ret.append(burin.types.Polyline(pts[vertices]))
+            center, clockwise = arcs[(i, arc)]
+            ret.append(burin.types.Arc(pts[i].copy(), pts[arc].copy(), center, clockwise))
+            vertices, i = [arc], arc
+        else:
+            vertices.append(line)
+            i = line
+
+    if len(vertices) > 1:
+        ret.append(burin.types.Polyline(pts[vertices]))
+    return ret
+
+def fit_group(group, tolerance):
+    """ Fit arcs to every polyline (and spline, as it's drawn) in a group of segments. Polylines that carry
+    extra meaning - like Multilayer's backlash strokes - are left alone. """
+    ret = []
+    for seg in group:
+        if isinstance(seg, burin.types.Polyline) and not seg.__dict__.get('backlash', False):
+            ret += fit_polyline(seg.coords, tolerance)
+        elif isinstance(seg, burin.types.BSpline):
+            ret += fit_polyline(seg.linearize_for_drawing(), tolerance)
+        else:
+            ret.append(seg)
+    return ret
@@ -0,0 +1,103 @@
+""" Running the same process over many dxf files. Each file is a full start + all run in its own
+directory, and files are spread over a bounded pool of worker processes. Running a batch into the same
+directory again only rebuilds units that changed, unless it's forced. Parameters come from a
+dict (usually loaded from json) rather than prompts:
+
+    {"*" : {"x" : 0, "y" : 0},        # for every unit
+     "Fiducials" : {"theta" : 0.1}}   # for a unit by name
+"""
+
+import concurrent.futures
+import json
+import os
+import time
+import traceback
+
+from burin.pipeline import Pipeline, load_state
+
+
+def unit_parameters(parameters, unit):
+    acc = dict(parameters.get('*', {}))
+    acc.update(parameters.get(unit, {}))
+    return acc
+
+def output_directories(outdir, files):
+    """ One directory per file, named after it - disambiguated if two files share a name """
+    seen, acc = {}, []
+    for f in files:
+        stem = os.path.splitext(os.path.basename(f))[0]
+        n = seen.get(stem, 0)
+        seen[stem] = n + 1
+        acc.append(os.path.join(outdir, stem if n == 0 else f"{stem}-{n}"))
+    return acc
+
+def start(process, filepath, directory):
+    """ Pipeline.start, keeping the hashes of the last run in directory if it had the same process and units -
+    so units whose geometry and parameters haven't changed since are up to date """
+    previous = load_state(directory) if os.path.exists(os.path.join(directory, 'state.json')) else None
+    pipeline = Pipeline.start(filepath, process, directory)
+    if previous is not None and 'hashes' in previous:
+        # Saved units have lists where fresh ones have tuples
+        fresh = json.loads(json.dumps([pipeline.state['process'], pipeline.state['units']]))
+        if fresh == [previous['process'], previous['units']]:
+            pipeline.state['hashes'] = previous['hashes']
+            pipeline.save()
+    return pipeline
+
+def run_job(process, filepath, directory, parameters, force = False):
+    """ start + all for one file. Never raises - failures are reported in the returned record """
+    record = {'file' : filepath, 'directory' : directory, 'ok' : False, 'error' : None, 'units' : {}, 'skipped' : []}
+    start_time = time.perf_counter()
+    try:
+        pipeline = start(process, filepath, directory)
+        for unit in pipeline.units():
+            values = unit_parameters(parameters, unit)
+            declared = pipeline.record(unit)['parameters']
+            pipeline.set_parameters(unit, **{p : v for p, v in values.items() if p in declared})
+        pipeline.parameters()
+        pipeline.load()
+
+        for unit in pipeline.units():
+            unit_start = time.perf_counter()
+            if not pipeline.run(unit, force):
+                record['skipped'].append(unit)
+            record['units'][unit] = time.perf_counter() - unit_start
+        record['ok'] = True
+    except (Exception, SystemExit) as e:
+        # Processes sometimes just exit() on bad input
+        record['error'] = f"{type(e).__name__}: {e}"
+        record['traceback'] = traceback.format_exc()
+        
+    record['seconds'] = time.perf_counter() - start_time
+    return record
+
+
+def run_batch(process, outdir, files, parameters, jobs = None, force = False, finished = None):
+    """ Run every file through process in a pool of jobs workers. Returns a record per file (see run_job),
+    in the same order as files. finished(record) is called as each file completes. """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    directories = output_directories(outdir, files)
+    records = [None] * len(files)
+    
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = {pool.submit(run_job, process, f, d, parameters, force) : i
+                   for i, (f, d) in enumerate(zip(files, directories))}
+        for future in concurrent.futures.as_completed(futures):
+            record = future.result()
+            records[futures[future]] = record
+            if finished is not None:
+                finished(record)
+    return records
+
+
+def summary(records):
+    """ Human-readable table of a batch's results """
+    lines = [f"{'file':<40} {'status':<8} {'time (s)':>10}"]
+    for r in records:
+        lines.append(f"{os.path.basename(r['file']):<40} {'ok' if r['ok'] else 'FAILED':<8} {r['seconds']:>10.2f}")
+    failed = [r for r in records if not r['ok']]
+    lines.append(f"{len(records) - len(failed)} of {len(records)} succeeded in {sum(r['seconds'] for r in records):.2f}s of work")
+    for r in failed:
+        lines.append(f"    {r['file']}: {r['error']}")
+    return '\n'.join(lines)
@@ -1,48 +1,62 @@
 
 import burin.types
+import burin.gcode as gcode
+import burin.arcfit as arcfit
+import burin.feeds as feeds
+import burin.toolpath as toolpath
 
 
 class GCodeGen:
 
     def __init__(self):
         
-        self.speeds = {'v' : 4000, 'z' : 100, 'travel' : 10000, 'plot' : 2000}
+        # Plot moves speed up from plot towards plot_max wherever the geometry allows, if it's set (None for a
+        # constant feed)
+        self.speeds = {'v' : 4000, 'z' : 100, 'travel' : 10000, 'plot' : 2000, 'plot_max' : None}
         self.heights = {'z_clearance' : 15, 'v_clearance' : 1.0, # Z and V axis heights for moving around during setup
                         'z_travel' : 10,  'v_travel' : 4, # Z and V axis heights for rapiding around during plotting
                         'v_toolchange' : 5.0, # V height for changing tools. (v_down - v_toolchange) controls force using during plotting
                         'v_down' : 5.5} # V height for actually plotting
-
-    def generate_segment(self, segment):
-        """ V-axis pen plotting gcode for a continuous segment of objects. """ 
-
-        plot = self.speeds['plot']
-        
-        start = segment[0].endpoints()[0]
-        yield f"G0 X{start[0]} Y{start[1]} F{self.speeds['travel']}"
-        yield f"G0 V{self.heights['v_down']} F{self.speeds['v']}"
-
-        for i, seg in enumerate(segment):
-            if isinstance(seg, burin.types.Polyline):
-                n = 1 if i == 0 else 0
-                for x,y in seg.coords[n:]:
-                    yield f"G1 X{x} Y{y} F{plot}"
-
-            elif isinstance(seg, burin.types.BSpline):
-                
-                n = 1 if i == 0 else 0
-                for x,y in seg.linearize_for_drawing()[n:]:
-                    yield f"G1 X{x} Y{y} F{plot}"
-                          
-            elif isinstance(seg, burin.types.Arc):
-                start, end = seg.endpoints()
-                I,J = seg.center - start
-                if i != 0:
-                    yield f"G1 X{start[0]} Y{start[1]} F{plot}"
-                yield f"G{2 if seg.clockwise else 3} X{end[0]} Y{end[1]} I{I} J{J} F{plot}"               
-            else:
-                yield ";Point!"
-            
-        yield f"G0 V{self.heights['v_travel']} F{self.speeds['v']}"
+        self.precision = gcode.DEFAULT_PRECISION # Decimal places for X and Y
+        self.modal = True # Leave out words the controller would already assume (see burin.gcode.modal_lines)
+        self.arc_tolerance = None # How far fitted arcs may stray from the drawn geometry, or None to leave it as is
+        self.planner = None
+
+    def stroke(self, builder, segment):
+        """ Add V-axis pen plotting of a continuous segment of objects to a burin.toolpath.Builder """
+        if self.arc_tolerance:
+            segment = arcfit.fit_group(segment, self.arc_tolerance)
+        planner = self.feed_planner()
+        builder.stroke(segment, self.speeds['travel'], self.speeds['plot'],
+                       planner.group(segment) if planner is not None else None)
+
+    def compile(self, segments):
+        """ Toolpaths plotting every group of segments, each marked as a group - a batch of groups at a time, as
+        they arrive (see burin.toolpath.batched) """
+        for batch in toolpath.batched(segments):
+            builder = toolpath.Builder()
+            for segment in batch:
+                builder.mark()
+                self.stroke(builder, segment)
+            yield builder.build()
+
+    def translate(self, path):
+        """ G-code for a toolpath, with the pen lowered and lifted on the V axis """
+        return gcode.translate(path, f"G0 V{self.heights['v_down']} F{self.speeds['v']}",
+                               f"G0 V{self.heights['v_travel']} F{self.speeds['v']}", self.precision,
+                               modal = self.modal)
+
+    def feed_planner(self):
+        """ Adaptive feeds between the plot and plot_max speeds (made on first use, so speeds can be changed
+        before then), or None for a constant feed """
+        if self.planner is None and self.speeds.get('plot_max') is not None:
+            self.planner = feeds.AdaptiveFeeds(self.speeds['plot'], self.speeds['plot_max'])
+        return self.planner
+
+    def report_feeds(self):
+        """ How much time adaptive feeds saved, as a comment """
+        if self.planner is not None:
+            yield from self.planner.report()
 
 
     def go_to_clearance(self):
@@ -15,10 +15,10 @@ def load_layers(fp, remove_empty = True):
     if remove_empty:
 
         unseen = set(layers)
+        cache = {}
         for e in doc.modelspace():
-            key = e.dxf.layer
-            if key in unseen:
-                unseen.remove(key)
+            # Layers only reached through block contents aren't empty either
+            unseen -= entity_layers(e, cache)
             if not unseen:
                 break
 
@@ -26,43 +26,131 @@ def load_layers(fp, remove_empty = True):
     
     return layers
 
-def load_entities(fp, layers, arcs = True):
-    """ Load a subset of a dxf file """
-    msp = ezdxf.readfile(fp).modelspace()
-    objects = defaultdict(lambda: [])
-    errors = []
 
-    splinable = ezdxf.entities.Ellipse
+def block_layers(doc, name, cache):
+    """ Which (block-local) layers does a block put geometry on, counting blocks inserted in it? Layer '0'
+    means 'whatever layer the block is inserted on', as in dxftypes.Block.layers. """
+    if name in cache:
+        return cache[name]
+    # Nothing, until we know better - so self-referential blocks can't recurse forever
+    cache[name] = set()
+    layout = doc.blocks.get(name)
+    acc = set()
+    if layout is not None:
+        for e in layout:
+            acc |= entity_layers(e, cache)
+    cache[name] = acc
+    return acc
+
+def entity_layers(e, cache):
+    """ Which layers does an entity put geometry on - an INSERT's are those of its block's contents """
+    key = e.dxf.layer
+    if isinstance(e, ezdxf.entities.Insert):
+        return set(key if local == '0' else local for local in block_layers(e.doc, e.dxf.name, cache))
+    return {key}
+
+
+def insert_matrices(insert):
+    """ Every 2x3 matrix placing the block of an INSERT - more than one if it's a MINSERT array """
+    inserts = insert.multi_insert() if insert.mcount > 1 else [insert]
+    acc = []
+    for i in inserts:
+        m = np.array(list(i.matrix44().rows()))
+        acc.append(m[[0,1,3]][:,0:2].T)
+    return acc
+
+
+def convert_entities(entities, arcs, blocks, errors):
+    """ Converts a stream of dxf entities to (layer, dxftypes object) pairs. Block references are
+    collected by block name and layer, so that every instance of a block can be produced at once. """
+
+    elliptical = ezdxf.entities.Ellipse
     if not arcs:
-        splinable = ezdxf.entities.Arc, ezdxf.entities.Circle,  ezdxf.entities.Ellipse
+        elliptical = ezdxf.entities.Arc, ezdxf.entities.Circle,  ezdxf.entities.Ellipse
 
-    layers = set(layers)
-    
-    for e in msp:
+    references = {}
+        
+    for e in entities:
         key = e.dxf.layer
-        if key not in layers:
-            continue
         
         if isinstance(e, ezdxf.entities.Line):
-            objects[key].append(dxftypes.Polyline(np.array([e.dxf.start, e.dxf.end])))
+            yield key, dxftypes.Polyline(np.array([e.dxf.start, e.dxf.end]))
         elif isinstance(e,ezdxf.entities.Polyline):
             if e.dxf.flags > 1:
                 errors.append(("Unsupported polyline flags",e.dxf.handle))
             else:
-                objects[key].append(dxftypes.Polyline.from_dxf(e))
-                
-        elif isinstance(e, splinable):
-            # If we do this, it magically converts the object to a spline
-            # and appends it to the end of the file (instead of in place),
-            # so we don't have to worry at all!
-            e.to_spline(replace = False)
+                yield key, dxftypes.Polyline.from_dxf(e)
+        elif isinstance(e, ezdxf.entities.LWPolyline):
+            yield key, dxftypes.Polyline.from_lwpolyline(e)
+        elif isinstance(e, elliptical):
+            yield key, dxftypes.Ellipse.from_dxf(e)
         elif isinstance(e, ezdxf.entities.Circle): # Also covers arcs...
-            objects[key].append(dxftypes.Arc.from_dxf(e)) 
+            yield key, dxftypes.Arc.from_dxf(e)
         elif isinstance(e, ezdxf.entities.Spline):
-            objects[key].append(dxftypes.Spline.from_dxf(e))
+            yield key, dxftypes.Spline.from_dxf(e)
         elif isinstance(e, ezdxf.entities.Point):
-            objects[key].append(dxftypes.Point.from_dxf(e))
+            yield key, dxftypes.Point.from_dxf(e)
+        elif isinstance(e, ezdxf.entities.Insert):
+            name = e.dxf.name
+            if name not in blocks:
+                # Reserve the name first, so self-referential blocks can't recurse forever
+                blocks[name] = None
+                layout = e.doc.blocks.get(name)
+                if layout is None:
+                    errors.append((f"Missing block definition - {name}", e.dxf.handle))
+                else:
+                    blocks[name] = load_block(layout, arcs, blocks, errors)
+            block = blocks[name]
+            if block is None:
+                continue
+            if (name, key) not in references:
+                references[name, key] = []
+            references[name, key] += insert_matrices(e)
         else:
             errors.append((f"Unsupported dxf object - {e}",e.dxf.handle))
+
+    for (name, key), matrices in references.items():
+        yield key, dxftypes.BlockReferences(blocks[name], np.array(matrices))
+
+    
+def load_block(layout, arcs, blocks, errors):
+    children = defaultdict(lambda: [])
+    for key, obj in convert_entities(layout, arcs, blocks, errors):
+        children[key].append(obj)
+    return dxftypes.Block(layout.name, dict(children))
+
+    
+def load_entities(fp, layers, arcs = True):
+    """ Load a subset of a dxf file """
+    msp = ezdxf.readfile(fp).modelspace()
+    objects = defaultdict(lambda: [])
+    errors = []
+    blocks = {}
+
+    layers = set(layers)
+    cache = {}
+    entities = (e for e in msp if not entity_layers(e, cache).isdisjoint(layers))
+    
+    for key, obj in convert_entities(entities, arcs, blocks, errors):
+        if isinstance(obj, dxftypes.BlockReferences):
+            # Block contents on layer 0 take on the layer of the INSERT, but everything
+            # else stays on its own layer
+            for local in obj.block.layers():
+                target = key if local == '0' else local
+                if target in layers:
+                    objects[target].append(obj.on_layer(local))
+        else:
+            objects[key].append(obj)
             
     return dict(objects), errors
+
+
+def render_entities(entities, tolerance):
+    """ Flatten a list of loaded entities to a list of burin.types segments """
+    acc = []
+    for entity in entities:
+        if isinstance(entity, dxftypes.BlockReferences):
+            acc += entity.render_to_tolerance(tolerance)
+        else:
+            acc.append(entity.render_to_tolerance(tolerance))
+    return acc
@@ -1,5 +1,5 @@
-from geomdl import BSpline
 import numpy as np
+import itertools
 import math
 import ezdxf
 
@@ -9,45 +9,118 @@ import burin.types
 class Spline:
     def __init__(self,degree, control, knots):
         self.degree = degree
-        self.control = np.array(control)
-        self.knots = np.array(knots)
+        self.control = np.ascontiguousarray(control, dtype = float)
+        self.knots = np.ascontiguousarray(knots, dtype = float)
         
     def length_upper_bound(self):
-        acc = 0
-        n, _ = self.control.shape
-        for i in range(1,n):
-            delta = self.control[i] - self.control[i - 1]
-            acc += np.sqrt(delta.dot(delta))
-        
-        return acc
+        delta = np.diff(self.control, axis = 0)
+        return np.sqrt(np.sum(delta * delta, axis = 1)).sum()
 
     def render_to_tolerance(self,tolerance):
-        curve = BSpline.Curve()
-        curve.degree = self.degree
-        curve.ctrlpts = self.control.tolist()
-        curve.knotvector = self.knots.tolist()
-        curve.sample_size = max(2, math.ceil(self.length_upper_bound() / tolerance))
-
-        return burin.types.BSpline(curve, tolerance)
+        return burin.types.BSpline(self.degree, self.control, self.knots, tolerance)
     
     @staticmethod
     def from_dxf(s):
         return Spline(s.dxf.degree, s.control_points, s.knots)
     
+def flatten_bulges(points, bulges, tolerance):
+    """ Flatten a polyline with DXF bulges (tan of a quarter of the included angle, positive
+    for counterclockwise) on each segment, so that no arc piece is longer than the tolerance """
+    p0, p1, b = points[:-1], points[1:], bulges[:-1]
+    curved = b != 0
+    theta = 4 * np.arctan(b)
+    delta = p1 - p0
+    chord = np.sqrt(np.sum(delta * delta, axis = 1))
+
+    # Center sits on the chord's perpendicular bisector, with straight segments getting a dummy center
+    safe = np.where(curved, b, 1.0)
+    perp = np.stack([0 - delta[:,1], delta[:,0]], axis = 1)
+    center = 0.5 * (p0 + p1) + perp * ((1 - safe * safe) / (4 * safe))[:,None]
+    radius = np.where(curved, chord / np.maximum(np.abs(2 * np.sin(theta / 2)), 1e-300), 0)
+    
+    counts = np.where(curved, np.maximum(1, np.ceil(radius * np.abs(theta) / tolerance)), 1).astype(int)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - starts[owner]) / counts[owner]
+
+    # Rotate the start of each arc about its center, or just lerp along straight segments
+    angle = theta[owner] * t
+    c, s = np.cos(angle), np.sin(angle)
+    v = p0[owner] - center[owner]
+    rotated = center[owner] + np.stack([c * v[:,0] - s * v[:,1], s * v[:,0] + c * v[:,1]], axis = 1)
+    linear = p0[owner] + delta[owner] * t[:,None]
+    
+    return np.vstack([np.where(curved[owner][:,None], rotated, linear), points[-1:]])
+    
+
 class Polyline:
-    def __init__(self, points):
+    def __init__(self, points, bulges = None):
         self.points = points
+        self.bulges = bulges
 
     def render_to_tolerance(self, tolerance):
-        # Here for parallelism with Splines - doesn't apply the tolerance
-        return burin.types.Polyline(self.points[:,0:2])
+        # Straight polylines are here for parallelism with Splines - the tolerance only applies to bulges
+        if self.bulges is None or not np.any(self.bulges[:-1]):
+            return burin.types.Polyline(self.points[:,0:2])
+        return burin.types.Polyline(flatten_bulges(self.points[:,0:2], self.bulges, tolerance))
         
     @staticmethod
     def from_dxf(line):
-        vertices = [v.dxf.location for v in line.vertices]
+        vertices = line.vertices
+        n = len(vertices) + (line.dxf.flags & 1)
+        points = np.empty((n, 3))
+        bulges = np.zeros(n)
+        points[0:len(vertices)] = np.fromiter(itertools.chain.from_iterable(v.dxf.location for v in vertices),
+                                              dtype = float, count = 3 * len(vertices)).reshape((-1,3))
+        bulges[0:len(vertices)] = np.fromiter((v.dxf.bulge for v in vertices), dtype = float, count = len(vertices))
         if line.dxf.flags & 1:
-            vertices.append(vertices[0])
-        return Polyline(np.array(vertices))
+            points[-1] = points[0]
+        return Polyline(points, bulges)
+
+    @staticmethod
+    def from_lwpolyline(line):
+        # Packed x, y, start width, end width, bulge for every vertex
+        packed = np.frombuffer(line.lwpoints.values, dtype = float).reshape((-1,5))
+        if line.closed:
+            packed = np.vstack([packed, packed[0:1]])
+            packed[-1,4] = 0
+        return Polyline(packed[:,0:2].copy(), packed[:,4].copy())
+
+
+class Ellipse:
+    """ Elliptical arcs, plus circles and arcs when they're not being kept as arcs """
+
+    def __init__(self, center, major, minor, start, end):
+        self.center = center
+        self.major = major
+        self.minor = minor
+        self.start = start # Parameter range, in radians
+        self.end = end
+
+    def render_to_tolerance(self, tolerance):
+        span = self.end - self.start
+        # Like splines, use a cheap upper bound on length - a circle on the major axis
+        radius = max(np.sqrt(self.major.dot(self.major)), np.sqrt(self.minor.dot(self.minor)))
+        t = np.linspace(self.start, self.end, max(2, 1 + math.ceil(radius * span / tolerance)))
+        points = self.center + np.outer(np.cos(t), self.major) + np.outer(np.sin(t), self.minor)
+        return burin.types.Polyline(points)
+
+    @staticmethod
+    def from_dxf(e):
+        center = np.array(e.dxf.center)[0:2]
+        if isinstance(e, ezdxf.entities.Ellipse):
+            major, minor = np.array(e.dxf.major_axis)[0:2], np.array(e.minor_axis)[0:2]
+            start, end = e.dxf.start_param, e.dxf.end_param
+        else:
+            r = e.dxf.radius
+            major, minor = np.array([r, 0.0]), np.array([0.0, r])
+            start, end = 0.0, 2 * math.pi
+            if isinstance(e, ezdxf.entities.Arc):
+                start, end = math.radians(e.dxf.start_angle), math.radians(e.dxf.end_angle)
+        # Always counterclockwise, from start to end
+        while end <= start:
+            end += 2 * math.pi
+        return Ellipse(center, major, minor, start, end)
 
 class Point:
 
@@ -88,3 +161,62 @@ class Arc:
         
         point = center + np.array([radius, 0])
         return Arc(point, point, center)
+
+
+class Block:
+    """ A block definition - flattened at most once per tolerance, no matter how many times it is inserted """
+
+    def __init__(self, name, children):
+        self.name = name
+        self.children = children # layer name -> list of dxftypes objects
+        self.rendered = {}
+
+    def layers(self):
+        """ Which (block-local) layers does this block put geometry on? Layer '0' means 'whatever
+        layer the block is inserted on'."""
+        acc = set()
+        for key, children in self.children.items():
+            for c in children:
+                if isinstance(c, BlockReferences):
+                    acc |= set(key if local == '0' else local for local in c.block.layers())
+                else:
+                    acc.add(key)
+        return acc
+
+    def render(self, tolerance):
+        if tolerance in self.rendered:
+            return self.rendered[tolerance]
+
+        acc = {}
+        for key, children in self.children.items():
+            for c in children:
+                if isinstance(c, BlockReferences):
+                    for local in c.block.layers():
+                        target = key if local == '0' else local
+                        acc.setdefault(target, []).extend(c.on_layer(local).render_to_tolerance(tolerance))
+                    continue
+                
+                segment = c.render_to_tolerance(tolerance)
+                if isinstance(segment, burin.types.BSpline):
+                    # Splines don't survive arbitrary transforms, so settle them now
+                    segment = burin.types.Polyline(segment.linearize_for_drawing())
+                acc.setdefault(key, []).append(segment)
+                
+        self.rendered[tolerance] = acc
+        return acc
+
+
+class BlockReferences:
+    """ Every insertion of a block on a single layer - renders to a list of segments, rather than just one """
+
+    def __init__(self, block, matrices, layer = '0'):
+        self.block = block
+        self.matrices = matrices # k x 2 x 3 stack of transforms
+        self.layer = layer # Which block-local layer to take geometry from
+
+    def on_layer(self, layer):
+        return BlockReferences(self.block, self.matrices, layer)
+
+    def render_to_tolerance(self, tolerance):
+        segments = self.block.render(tolerance).get(self.layer, [])
+        return burin.types.transform_instances(segments, self.matrices, tolerance)
@@ -0,0 +1,259 @@
+""" How long will a job take? Plays G-code back through a simple motion planner, the way the controller does.
+
+Every move gets a trapezoidal velocity profile, limited by its feed, and by per-axis speed and acceleration limits
+along its direction. Speeds at the junctions between moves are limited by junction deviation (as in grbl and
+RepRapFirmware), and the usual backward / forward passes make sure every move can slow down in time for the next.
+Both passes are prefix minimums, and numbers are parsed byte-wise, so everything runs in NumPy - only lines
+other than moves (tool changes, dwells, pauses) are looked at in Python.
+
+Works on any stream of G-code lines - the output of a process's generate_code, or a written file:
+
+    estimate(pipeline.generate('all'))
+    estimate_file('out/all.gcode')
+"""
+
+import numpy as np
+import re
+
+import burin.output as output
+
+# Roughly our plotter - speeds in mm/s, accelerations in mm/s^2, junction deviation in mm. Pen-down is any V at or
+# past pen_down. X and Y have to come first.
+MACHINE = {'speed' : {'X' : 250, 'Y' : 250, 'Z' : 15, 'V' : 100},
+           'acceleration' : {'X' : 1000, 'Y' : 1000, 'Z' : 200, 'V' : 1000},
+           'junction_deviation' : 0.05,
+           'pen_axis' : 'V', 'pen_down' : 5.0}
+
+PAUSES = {'M0', 'M1', 'M25', 'M226'}
+# Commands that don't make the machine stop
+SETTINGS = {'G21', 'G90'}
+POWERS = 10.0 ** np.arange(-32, 33)
+CHUNK = 1 << 22
+
+
+def words(data, first_line = 0):
+    """ Every word (a capital letter, then a number) in a chunk of G-code, as arrays of letters (as bytes), values,
+    and line numbers. Numbers are read byte-wise in NumPy, not word by word in Python. Also returns a list of
+    (line number, text) for lines that don't start with a word we can parse like that - anything but motion. """
+    b = np.frombuffer(data, dtype = np.uint8)
+    newline = b == 10
+    separator = newline | (b == 32) | (b == 9) | (b == 13)
+    begin = ~separator & np.concatenate([[True], separator[:-1]])
+    begins = np.flatnonzero(begin)
+    ends = np.flatnonzero(~separator & np.concatenate([separator[1:], [True]])) + 1
+    is_word = (b[begins] >= 65) & (b[begins] <= 90)
+
+    # Which token each digit, dot, and minus sign belongs to
+    token = np.cumsum(begin, dtype = np.int32) - 1
+    def owners(mask):
+        position = np.flatnonzero(mask)
+        return position, token[position]
+
+    position, owner = owners((b >= 48) & (b <= 57))
+    dot, dot_owner = owners(b == 46)
+    dots = np.copy(ends)
+    dots[dot_owner] = dot
+    # Each digit's place value depends on how far it is from the dot (or the end, if there isn't one)
+    place = dots[owner]
+    place -= position
+    place -= place > 0
+    np.clip(place, -32, 32, out = place)
+    place += 32
+    values = np.bincount(owner, (b[position] - 48) * POWERS[place], minlength = len(begins))
+    _, minus_owner = owners(b == 45)
+    values[minus_owner] *= -1
+
+    starts = begins[is_word]
+    letters, values = b[starts], values[is_word]
+    lines = np.searchsorted(np.flatnonzero(newline), starts) + first_line
+
+    # Lines whose first word is something other than G0-G3, or a modal axis / feed word
+    first = np.concatenate([[True], lines[1:] != lines[:-1]]) if len(lines) else np.zeros(0, dtype = bool)
+    motion = ((letters == ord('G')) & np.isin(values, (0, 1, 2, 3))) | ~np.isin(letters, (ord('G'), ord('M'), ord('T')))
+    special = []
+    if np.any(first & ~motion):
+        breaks = np.concatenate([[-1], np.flatnonzero(newline), [len(b)]])
+        for l in lines[first & ~motion]:
+            text = bytes(data[breaks[l - first_line] + 1 : breaks[l - first_line + 1]]).decode()
+            special.append((int(l), text))
+    return letters, values, lines, special
+
+def parse(data, axes):
+    """ Turn G-code (bytes) into arrays describing every move: where it starts and ends (one column per axis), its
+    feed (mm/min) and motion mode, whether the machine stops before it, and arc centers (from I and J).
+    Returns those, plus the time spent in dwells and the number of pauses. """
+
+    data = re.sub(rb';[^\n]*', b'', data)
+    chunks, special, line = [], [], 0
+    while data:
+        cut = data.rfind(b'\n', 0, CHUNK) + 1 if len(data) > CHUNK else len(data)
+        cut = cut if cut > 0 else len(data)
+        chunk = data[:cut]
+        *found, extra = words(chunk, line)
+        chunks.append(found)
+        special += extra
+        line += chunk.count(b'\n')
+        data = data[cut:]
+    letters, values, lines = (np.concatenate(x) if x else np.zeros(0) for x in zip(*chunks)) if chunks else [np.zeros(0)] * 3
+
+    dwell, pauses, homes, stops = 0.0, 0, [], []
+    for l, text in special:
+        command, *rest = text.split()
+        if command == 'G91':
+            raise ValueError(f"Relative positioning isn't supported (line {l + 1})")
+        elif command == 'G4':
+            for w in rest:
+                dwell += float(w[1:]) / 1000 if w[0] == 'P' else float(w[1:]) if w[0] == 'S' else 0
+        elif command == 'G28':
+            homes.append((l, [w[0] for w in rest if w[0] in axes] or axes))
+        elif command in PAUSES:
+            pauses += 1
+        if command not in SETTINGS:
+            stops.append(l)
+
+    # One row per motion line (and per home), one column per axis, then feed, mode, I, and J
+    columns = {a : i for i,a in enumerate(axes + ['F', 'G', 'I', 'J'])}
+    lookup = np.full(256, -1)
+    for c, i in columns.items():
+        lookup[ord(c)] = i
+    specials = np.array(sorted(l for l, _ in special), dtype = np.int64)
+    motion = ~np.isin(lines, specials) & (lookup[letters.astype(np.int64)] >= 0)
+    home_lines = np.array([l for l, _ in homes], dtype = np.int64)
+    # Lines are already in order, so finding the distinct ones doesn't need a sort
+    rows = np.concatenate([lines[motion], home_lines])
+    if len(home_lines):
+        rows.sort(kind = 'stable')
+    rows = rows[np.concatenate([[True], rows[1:] != rows[:-1]])] if len(rows) else rows
+
+    table = np.full((len(rows), len(columns)), np.nan)
+    table[np.searchsorted(rows, lines[motion]), lookup[letters[motion].astype(np.int64)]] = values[motion]
+    homed = np.isin(rows, home_lines)
+    for l, homing in homes:
+        table[np.searchsorted(rows, l), [columns[a] for a in homing]] = 0.0
+
+    # Carry modal values (everything but I and J) forward, from their defaults
+    k = len(axes)
+    defaults = np.array([0.0] * k + [1000.0, 1.0])
+    state = np.vstack([defaults, table[:,0:k + 2]])
+    filled = np.where(np.isnan(state), 0, np.arange(len(state))[:,None])
+    state = state[np.maximum.accumulate(filled, axis = 0), np.arange(k + 2)]
+    before, after = state[:-1], state[1:]
+
+    mode = after[:,k + 1]
+    move = ~homed & (np.any(before[:,0:k] != after[:,0:k], axis = 1) | (mode >= 2))
+    offsets = np.nan_to_num(table[move][:,k + 2:k + 4])
+
+    # Did anything that might stop the machine happen since the previous move?
+    since = np.searchsorted(np.array(stops, dtype = np.int64), rows[move])
+    stopped = np.concatenate([[True], since[1:] != since[:-1]]) if len(since) else np.zeros(0, dtype = bool)
+
+    starts = before[move][:,0:k]
+    return (starts, after[move][:,0:k], after[move][:,k], mode[move], starts[:,0:2] + offsets, stopped,
+            dwell, pauses)
+
+def arc_geometry(starts, ends, centers, clockwise):
+    """ Lengths, entry and exit tangents (in the XY plane), and radii of arcs """
+    a, b = starts[:,0:2] - centers, ends[:,0:2] - centers
+    r = np.sqrt(np.einsum('ij,ij->i', a, a))
+    sweep = np.arctan2(a[:,0] * b[:,1] - a[:,1] * b[:,0], np.einsum('ij,ij->i', a, b))
+    sweep = np.where(clockwise & (sweep >= 0), sweep - 2 * np.pi, sweep)
+    sweep = np.where(~clockwise & (sweep <= 0), sweep + 2 * np.pi, sweep)
+    turn = np.where(clockwise, -1.0, 1.0)[:,None] / r[:,None]
+    entry = turn * np.stack([-a[:,1], a[:,0]], axis = 1)
+    exit = turn * np.stack([-b[:,1], b[:,0]], axis = 1)
+    return r * np.abs(sweep), entry, exit, r
+
+def junction_speeds(exits, entries, accel, deviation):
+    """ Junction deviation: the (squared) speed at which the turn from each exit direction to the following entry
+    direction stays within the deviation of a sharp corner """
+    cos = np.clip(-np.einsum('ij,ij->i', exits, entries), -1.0, 1.0)
+    sin_half = np.sqrt(0.5 * (1 - cos))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        junction = accel * deviation * sin_half / (1 - sin_half)
+    return np.where(sin_half > 1 - 1e-9, np.inf, junction)
+
+def estimate(lines, machine = MACHINE):
+    """ Estimated time (seconds), distances drawn and travelled (mm), pen lifts, and pauses for a G-code stream """
+    return estimate_bytes('\n'.join(lines).encode(), machine)
+
+def estimate_file(path, machine = MACHINE):
+    return estimate_bytes(output.read_bytes(path), machine)
+
+def estimate_bytes(data, machine = MACHINE):
+    axes = list(machine['speed'])
+    starts, ends, feeds, mode, centers, stops, dwell, pauses = parse(data, axes)
+    n = len(feeds)
+    result = {'time' : dwell, 'moves' : n, 'plot_distance' : 0.0, 'travel_distance' : 0.0, 'lifts' : 0, 'pauses' : pauses}
+    if n == 0:
+        return result
+
+    vmax_axis = np.array([machine['speed'][a] for a in axes], dtype = float)
+    amax_axis = np.array([machine['acceleration'][a] for a in axes], dtype = float)
+
+    delta = ends - starts
+    length = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+    with np.errstate(invalid = 'ignore'):
+        # Full circles don't go anywhere, but arcs are fixed up below anyway
+        entry = delta / length[:,None]
+        direction = np.abs(entry)
+    exit = entry.copy()
+    speed = feeds / 60
+
+    # (Arcs without a center can't be run, but we'll call them straight lines rather than fail)
+    arc = (mode >= 2) & np.any(centers != starts[:,0:2], axis = 1)
+    if np.any(arc):
+        arc_length, a, b, r = arc_geometry(starts[arc], ends[arc], centers[arc], mode[arc] == 2)
+        length[arc] = arc_length
+        entry[arc], exit[arc], direction[arc] = 0.0, 0.0, 0.0
+        entry[arc,0:2], exit[arc,0:2] = a, b
+        # Arcs use both X and Y all the way around, and centripetal acceleration limits how fast tight ones can go
+        direction[arc,0:2] = np.sqrt(0.5)
+        speed[arc] = np.minimum(speed[arc], np.sqrt(amax_axis[0:2].min() * r))
+
+    # The fastest each move can go, and accelerate, along its direction without exceeding any axis's limits
+    with np.errstate(divide = 'ignore'):
+        speed = np.minimum(speed, (vmax_axis / direction).min(axis = 1))
+        accel = (amax_axis / direction).min(axis = 1)
+
+    junction = junction_speeds(exit[:-1], entry[1:], np.minimum(accel[:-1], accel[1:]), machine['junction_deviation'])
+
+    # Squared speeds from here on. limit[k] bounds the speed entering move k (limit[n] is the very end)
+    limit = np.zeros(n + 1)
+    limit[1:n] = np.minimum(junction, np.minimum(speed[:-1], speed[1:]) ** 2)
+    limit[0:n][stops] = 0.0
+
+    # Backward: w[k] = min(limit[k], w[k+1] + c[k]), forward: w[k+1] = min(w[k+1], w[k] + c[k])
+    gain = 2 * accel * length
+    total = np.concatenate([[0.0], np.cumsum(gain)])
+    backward = np.minimum.accumulate((limit + total)[::-1])[::-1] - total
+    w = np.maximum(np.minimum.accumulate(backward - total) + total, 0.0)
+
+    v0, v1, vm = np.sqrt(w[:-1]), np.sqrt(w[1:]), speed
+    cruise = length - (vm ** 2 - w[:-1]) / (2 * accel) - (vm ** 2 - w[1:]) / (2 * accel)
+    peak = np.sqrt(np.maximum(0.5 * (gain + w[:-1] + w[1:]), 0.0))
+    time = np.where(cruise >= 0,
+                    (vm - v0) / accel + (vm - v1) / accel + np.maximum(cruise, 0) / vm,
+                    (peak - v0) / accel + (peak - v1) / accel)
+
+    # Where's the pen?
+    planar = np.where(arc, length, np.sqrt(np.einsum('ij,ij->i', delta[:,0:2], delta[:,0:2])))
+    pen = axes.index(machine['pen_axis'])
+    down_before, down_after = starts[:,pen] >= machine['pen_down'], ends[:,pen] >= machine['pen_down']
+    drawing = down_before & down_after
+
+    result['time'] += float(time.sum())
+    result['plot_distance'] = float(planar[drawing].sum())
+    result['travel_distance'] = float(planar[~drawing].sum())
+    result['lifts'] = int(np.count_nonzero(down_before & ~down_after))
+    return result
+
+def duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+def report(result):
+    return (f"{duration(result['time'])} - {result['moves']} moves, {result['plot_distance']:.0f}mm drawn, "
+            f"{result['travel_distance']:.0f}mm travelled, {result['lifts']} pen lifts, {result['pauses']} pauses")
@@ -0,0 +1,101 @@
+""" Plotting feeds that follow the geometry, rather than one feed for everything.
+
+Every move in a group gets the fastest feed (between a floor and a ceiling) that the machine could reach between
+the turns at either end of it: sharp corners are limited by junction deviation, and gentle curves (runs of short
+lines that turn a little at every vertex, or arcs) by centripetal acceleration, both with the limits burin.estimate
+uses. Long straight runs get the ceiling, and short moves between corners stay slow. The floor is the old
+constant plot feed, so nothing ever goes slower than it used to, and the ends of groups, where the pen goes up and
+down, always get it. Feeds are rounded down to a step, so that modal output (burin.gcode.modal_lines) can drop
+most of them. """
+
+import numpy as np
+
+import burin.types
+import burin.estimate as estimate
+
+
+class AdaptiveFeeds:
+
+    def __init__(self, floor, ceiling, machine = estimate.MACHINE, step = 100):
+        self.floor, self.ceiling, self.step = floor, ceiling, step
+        self.acceleration = min(machine['acceleration']['X'], machine['acceleration']['Y'])
+        self.deviation = machine['junction_deviation']
+        # Time spent drawing (at cruise) with the floor feed everywhere, and with these feeds
+        self.constant, self.adaptive = 0.0, 0.0
+
+    def group(self, group):
+        """ Feeds (mm/min) for the segments of a group. Polylines get an array with a feed for the move to each
+        vertex (the first is the same as the second), arcs get one feed, and anything else gets None. """
+        entries, exits, lengths, limits, owners = [], [], [], [], []
+
+        for i, seg in enumerate(group):
+            if isinstance(seg, burin.types.Polyline) and not seg.__dict__.get('backlash', False) and len(seg.coords) > 1:
+                delta = np.diff(seg.coords[:,0:2], axis = 0)
+                length = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+                with np.errstate(invalid = 'ignore'):
+                    direction = np.nan_to_num(delta / length[:,None])
+                entries.append(direction)
+                exits.append(direction)
+                lengths.append(length)
+                limits.append(np.full(len(length), np.inf))
+                owners.append(np.full(len(length), i))
+            elif isinstance(seg, burin.types.Arc):
+                length, entry, exit, radius = estimate.arc_geometry(seg.start[None,0:2], seg.end[None,0:2],
+                                                                    seg.center[None,0:2], np.array([seg.clockwise]))
+                entries.append(entry)
+                exits.append(exit)
+                lengths.append(length)
+                limits.append(self.acceleration * radius)
+                owners.append(np.array([i]))
+            else:
+                # Points, backlash strokes, splines - stop, and start again afterwards
+                entries.append(np.zeros((1,2)))
+                exits.append(np.zeros((1,2)))
+                lengths.append(np.zeros(1))
+                limits.append(np.zeros(1))
+                owners.append(np.array([-1 - i]))
+
+        entry, exit = np.concatenate(entries), np.concatenate(exits)
+        length, limit, owner = np.concatenate(lengths), np.concatenate(limits), np.concatenate(owners)
+
+        # Squared speeds (mm/s) at every junction, including the ends of the group
+        floor = (self.floor / 60) ** 2
+        junction = np.full(len(length) + 1, floor)
+        turns = estimate.junction_speeds(exit[:-1], entry[1:], self.acceleration, self.deviation)
+        # A run of short lines that each turn a little is a curve - keep the centripetal acceleration in check
+        cos = np.clip(np.einsum('ij,ij->i', exit[:-1], entry[1:]), -1.0, 1.0)
+        with np.errstate(divide = 'ignore'):
+            curvature = np.arccos(cos) / (0.5 * (length[:-1] + length[1:]))
+            centripetal = self.acceleration / curvature
+        breaks = (owner[:-1] < 0) | (owner[1:] < 0)
+        junction[1:-1] = np.where(breaks, floor, np.minimum(turns, centripetal))
+
+        # The fastest each move could get, speeding up from its start and slowing down for its end
+        with np.errstate(invalid = 'ignore'):
+            peak = np.nan_to_num(0.5 * (junction[:-1] + junction[1:]) + self.acceleration * length, nan = np.inf)
+        speed = np.sqrt(np.minimum(limit, peak)) * 60
+        feeds = np.clip(speed, self.floor, self.ceiling)
+        feeds = np.minimum(self.floor + self.step * np.floor((feeds - self.floor) / self.step), self.ceiling)
+
+        drawn = owner >= 0
+        self.constant += float(np.sum(length[drawn]) / self.floor * 60)
+        self.adaptive += float(np.sum(length[drawn] / feeds[drawn]) * 60)
+
+        ret = []
+        pieces = np.split(feeds, np.cumsum([len(x) for x in lengths])[:-1])
+        for seg, mine, who in zip(group, pieces, owners):
+            if who[0] < 0:
+                ret.append(None)
+            elif isinstance(seg, burin.types.Arc):
+                ret.append(mine[0])
+            else:
+                ret.append(np.concatenate([mine[0:1], mine]))
+        return ret
+
+    def report(self):
+        """ A G-code comment comparing drawing time with these feeds to drawing at the floor everywhere, if
+        anything was drawn """
+        if self.constant > 0:
+            saved = 100 * (1 - self.adaptive / self.constant)
+            yield (f"; Adaptive feeds: drawing takes {estimate.duration(self.adaptive)} at cruise, instead of "
+                   f"{estimate.duration(self.constant)} at F{self.floor} ({saved:.0f}% faster)")
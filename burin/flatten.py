@@ -0,0 +1,95 @@
+""" Flattening dxf entities in a pool of worker processes. Each worker flattens a contiguous chunk of
+entities and hands the coordinates back through a shared memory block,  rather than pickling
+thousands of little arrays. Chunks are reassembled in submission order, so the output order is the
+same as flattening serially. Unlike the serial path, splines come back already linearized. """
+
+from multiprocessing import resource_tracker, shared_memory
+import math
+import os
+import numpy as np
+
+import burin.types
+import burin.dxfloader as dxfloader
+
+
+def flatten_chunk(entities, tolerance):
+    """ Worker side - flatten all the way to line segments (splines included), and pack the results """
+    segments = []
+    for s in dxfloader.render_entities(entities, tolerance):
+        if isinstance(s, burin.types.BSpline):
+            s = burin.types.Polyline(s.linearize_for_drawing())
+        segments.append(s)
+        
+    kinds, points, offsets = burin.types.pack_segments(segments)
+    if points.size == 0:
+        return kinds, offsets, None
+    
+    shm = untracked_block(points.nbytes)
+    np.ndarray(points.shape, dtype = float, buffer = shm.buf)[:] = points
+    shm.close()
+    return kinds, offsets, shm.name
+
+def untracked_block(size):
+    """ A new shared memory block that this process's resource tracker leaves alone - the parent frees it
+    once it's been copied out (or given up on) """
+    try:
+        return shared_memory.SharedMemory(create = True, size = size, track = False)
+    except TypeError:
+        # Before Python 3.13, blocks are always tracked - on POSIX, by their name with a leading slash
+        shm = shared_memory.SharedMemory(create = True, size = size)
+        if os.name == 'posix':
+            resource_tracker.unregister('/' + shm.name, 'shared_memory')
+        return shm
+
+def collect_chunk(result):
+    """ Parent side - copy a chunk out of shared memory, free it, and rebuild the segments """
+    kinds, offsets, name = result
+    if name is None:
+        return burin.types.unpack_segments(kinds, np.empty((0,2)), offsets)
+
+    shm = shared_memory.SharedMemory(name = name)
+    try:
+        points = np.ndarray((offsets[-1], 2), dtype = float, buffer = shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return burin.types.unpack_segments(kinds, points, offsets)
+
+def discard_chunk(future):
+    """ Parent side - free the block of a chunk that won't be collected, once it's done (if it ever started) """
+    if future.cancel() or future.exception() is not None:
+        return
+    name = future.result()[2]
+    if name is None:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name = name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def render_parallel(entities, tolerance, executor, workers, chunks_per_worker = 4):
+    """ Drop-in for dxfloader.render_entities, spreading the work over an executor with a given
+    number of workers. """
+    n = len(entities)
+    if n == 0:
+        return []
+    
+    size = max(1, math.ceil(n / (chunks_per_worker * workers)))
+    chunks = [entities[i:i + size] for i in range(0, n, size)]
+
+    futures = [executor.submit(flatten_chunk, c, tolerance) for c in chunks]
+    acc, collected = [], 0
+    try:
+        for f in futures:
+            acc += collect_chunk(f.result())
+            collected += 1
+    finally:
+        # Workers don't free their blocks, so if anything went wrong, the rest have to be freed here
+        for f in futures[collected:]:
+            f.cancel()
+        for f in futures[collected:]:
+            discard_chunk(f)
+    return acc
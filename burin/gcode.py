@@ -0,0 +1,262 @@
+""" Bulk G-code formatting. Coordinates are rounded to a fixed number of decimal places, and whole
+arrays of moves are formatted with a single %-format over one repeated template, rather than an
+f-string per number. """
+
+import operator
+import numpy as np
+
+import burin.toolpath as toolpath
+
+# A thousandth of a mm is well below anything the plotter can resolve
+DEFAULT_PRECISION = 3
+
+
+def rounded(coords, precision):
+    # Adding zero turns the -0.0s that rounding leaves behind into 0.0
+    return np.round(np.asarray(coords, dtype = float), precision) + 0.0
+
+def moves(command, coords, feed = None, precision = DEFAULT_PRECISION):
+    """ A line of G-code (command X.. Y.. [F..]) for every row of an n x 2 (or wider) array. feed may also be
+    an array, with a (whole number) feed for every row. """
+    coords = rounded(coords, precision).reshape((-1, np.shape(coords)[-1]))[:,0:2]
+    n,_ = coords.shape
+    if n == 0:
+        return []
+    template = f"{command} X%.{precision}f Y%.{precision}f"
+    if isinstance(feed, np.ndarray):
+        template += " F%d"
+        coords = np.column_stack([coords, feed])
+    elif feed is not None:
+        template += f" F{feed}"
+    return ((template + '\n') * n % tuple(coords.ravel().tolist())).split('\n')[:-1]
+
+def move(command, point, feed = None, precision = DEFAULT_PRECISION):
+    return moves(command, point, feed, precision)[0]
+
+def arcs(clockwise, starts, ends, centers, feeds, precision = DEFAULT_PRECISION):
+    """ A G2 (clockwise) or G3 line for every row of the arrays: from start to end, around center """
+    n = len(clockwise)
+    if n == 0:
+        return []
+    ends, offsets = rounded(ends, precision), rounded(np.asarray(centers) - starts, precision)
+    columns = np.column_stack([np.where(clockwise, 2, 3), ends[:,0:2], offsets[:,0:2], feeds])
+    template = f"G%d X%.{precision}f Y%.{precision}f I%.{precision}f J%.{precision}f F%.0f"
+    return ((template + '\n') * n % tuple(columns.ravel().tolist())).split('\n')[:-1]
+
+def translate(path, lower, lift, precision = DEFAULT_PRECISION, point = ";Point!", modal = True):
+    """ G-code for a burin.toolpath.Toolpath, formatted an opcode at a time: lower and lift are the lines that put
+    the tool down and pick it up, and point is what a DWELL becomes. Every group starts with a group marker.
+
+    If modal, words the controller would already assume are left out (see modal_lines). """
+    op = path.op
+    elided = modal_lines(path, lower, lift, precision, point) if modal else None
+    if elided is not None:
+        lines, keep = elided
+    else:
+        lines, keep = np.empty(len(path), dtype = object), np.ones(len(path), dtype = bool)
+        for code, command in ((toolpath.RAPID, "G0"), (toolpath.LINE, "G1")):
+            rows = np.flatnonzero(op == code)
+            lines[rows] = moves(command, path.xy[rows], path.feed[rows], precision)
+        rows = np.flatnonzero(path.arcs())
+        lines[rows] = arcs(op[rows] == toolpath.ARC_CW, path.starts()[rows], path.xy[rows], path.center[rows],
+                           path.feed[rows], precision)
+        lines[op == toolpath.LOWER] = lower
+        lines[op == toolpath.LIFT] = lift
+        lines[op == toolpath.DWELL] = point
+
+    # Groups start at the first line left of their rows
+    at = (np.cumsum(keep) - keep)[path.groups]
+    lines = lines[keep]
+    if len(at):
+        at = at + np.arange(len(at))
+        marked = np.full(len(lines) + len(at), GROUP, dtype = object)
+        kept = np.ones(len(marked), dtype = bool)
+        kept[at] = False
+        marked[kept] = lines
+        lines = marked
+    return lines.tolist()
+
+def motion_words(line):
+    """ A plain motion line (like "G0 V4 F4000") as its command, [(axis, value, word)], and (feed, word) - or None,
+    if it's anything else """
+    words = line.split()
+    if not words or words[0] not in MOTION:
+        return None
+    axes, feed = [], (np.nan, '')
+    for w in words[1:]:
+        if w[0] == 'F':
+            feed = float(w[1:]), ' ' + w
+        elif w[0] in AXES:
+            axes.append((w[0], float(w[1:]), ' ' + w))
+        else:
+            return None
+    return words[0], axes, feed
+
+def last_before(mask, inclusive = False):
+    """ For every row, the index of the last row (before it, or at it if inclusive) where mask is set - or -1 """
+    last = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+    return last if inclusive else np.concatenate([[-1], last[:-1]])
+
+def column(template, values):
+    """ %-format every row of values with the same template """
+    n = len(values)
+    if n == 0:
+        return []
+    return ((template + '\n') * n % tuple(np.asarray(values).ravel().tolist())).split('\n')[:-1]
+
+def modal_lines(path, lower, lift, precision = DEFAULT_PRECISION, point = ";Point!"):
+    """ translate's lines for every row of a toolpath, leaving out everything the controller would already assume:
+    motion commands (G0-G3) it's already in, feeds that haven't changed, and axis words for axes that are already
+    there. Straight moves that don't go anywhere are left out entirely - returns the lines, and which rows have one.
+    Arcs always keep their endpoints and centers.
+
+    Works on whole columns of the toolpath at once, starting from nothing known about the machine. lower and lift
+    have to be plain motion lines for it to follow them - if they aren't, returns None. """
+    op, n = path.op, len(path)
+    parsed = {toolpath.LOWER : motion_words(lower), toolpath.LIFT : motion_words(lift)}
+    if None in parsed.values():
+        return None
+
+    arc = path.arcs()
+    drawn = (op == toolpath.RAPID) | (op == toolpath.LINE) | arc
+    command = np.full(n, '', dtype = object)
+    for code, word in ((toolpath.RAPID, 'G0'), (toolpath.LINE, 'G1'), (toolpath.ARC_CW, 'G2'), (toolpath.ARC_CCW, 'G3')):
+        command[op == code] = word
+    motion = drawn | (op == toolpath.LOWER) | (op == toolpath.LIFT)
+
+    # Every axis (and the feed) as a column of values to compare, and of words to write
+    xy = rounded(path.xy, precision)
+    axes = {a : (np.full(n, np.nan), np.full(n, '', dtype = object)) for a in 'XY'}
+    rows = np.flatnonzero(drawn)
+    for k, a in enumerate('XY'):
+        axes[a][0][rows] = xy[rows,k]
+        axes[a][1][rows] = column(f" {a}%.{precision}f", xy[rows,k])
+    feeds, feed_words = np.full(n, np.nan), np.full(n, '', dtype = object)
+    for rows, template in ((np.flatnonzero(drawn & ~arc & ~np.isnan(path.feed)), " F%d"),
+                           (np.flatnonzero(arc & ~np.isnan(path.feed)), " F%.0f")):
+        feeds[rows], feed_words[rows] = path.feed[rows], column(template, path.feed[rows])
+    for code, (word, words, (feed, feed_word)) in parsed.items():
+        rows = op == code
+        command[rows] = word
+        for a, value, w in words:
+            values, text = axes.setdefault(a, (np.full(n, np.nan), np.full(n, '', dtype = object)))
+            values[rows], text[rows] = value, w
+        feeds[rows], feed_words[rows] = feed, feed_word
+
+    # An axis word is needed wherever the axis moves from where it was last put (or always, for arcs)
+    kept, moved = {}, np.zeros(n, dtype = bool)
+    for a, (values, _) in axes.items():
+        present = ~np.isnan(values)
+        last = last_before(present)
+        kept[a] = present & (arc | (last < 0) | (values != values[last]))
+        moved |= kept[a]
+    live = motion & (arc | moved)
+
+    # The motion command and feed in effect are the last written ones - but a feed from a move that was left out
+    # still applies
+    previous = last_before(live)
+    mode = np.where(previous >= 0, command[previous], None)
+    wanted = last_before(motion & ~np.isnan(feeds), inclusive = True)
+    wanted_feed = np.where(wanted >= 0, feeds[wanted], np.nan)
+    current = np.where(previous >= 0, wanted_feed[previous], np.nan)
+
+    lines = np.full(n, '', dtype = object)
+    lines[command != mode] = ' ' + command[command != mode]
+    for a, (_, text) in axes.items():
+        lines = lines + np.where(kept[a], text, '')
+    rows = np.flatnonzero(arc)
+    offsets = rounded(path.center[rows] - path.starts()[rows], precision)
+    lines[rows] = lines[rows] + np.array(column(f" I%.{precision}f J%.{precision}f", offsets) or [], dtype = object)
+    change = (wanted >= 0) & (wanted_feed != current)
+    lines[change] = lines[change] + feed_words[wanted[change]]
+
+    keep = live | (op == toolpath.DWELL)
+    # Every word went in with a space in front of it
+    lines[keep] = list(map(operator.itemgetter(slice(1, None)), lines[keep]))
+    lines[op == toolpath.DWELL] = point
+    return lines, keep
+
+
+MOTION = {'G0', 'G1', 'G2', 'G3'}
+# Words that describe where a straight move ends - anything else on a motion line is kept as is
+AXES = set('XYZUVWABC')
+
+class Mark:
+    """ Stands where a group starts, in a stream of G-code lines - so that the output can be indexed (and resumed).
+    It isn't a line, and never reaches a file or the machine (see indexed and unmarked). """
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'GROUP'
+
+# Code generators emit this at the start of every group
+GROUP = Mark()
+
+class MachineState:
+    """ What the controller's modal state (motion mode, feed, tool, and axis positions) is after a stream of lines """
+
+    def __init__(self):
+        self.mode, self.feed, self.tool, self.position = None, None, None, {}
+
+    def update(self, line):
+        words = line.split(';', 1)[0].split()
+        if not words:
+            return
+        command = words[0]
+        if command in MOTION:
+            self.mode, words = command, words[1:]
+        elif command[0] == 'T':
+            self.tool = command[1:]
+            return
+        elif command == 'G28':
+            for a in [w[0] for w in words[1:] if w[0] in AXES] or list(self.position):
+                self.position[a] = '0'
+            return
+        elif command[0] in 'GM':
+            return
+
+        # Values stay as text until a snapshot needs them
+        for w in words:
+            if w[0] == 'F':
+                self.feed = w[1:]
+            elif w[0] in AXES:
+                self.position[w[0]] = w[1:]
+
+    def snapshot(self):
+        return {'mode' : self.mode, 'feed' : None if self.feed is None else float(self.feed), 'tool' : self.tool,
+                'position' : {a : float(v) for a, v in self.position.items()}}
+
+def indexed(lines, groups):
+    """ Pass lines through, dropping group markers and adding an entry to groups for each: the byte offset and line
+    number of the group's first line, and the machine state there """
+    state, offset, n = MachineState(), 0, 0
+    for line in lines:
+        if line is GROUP:
+            groups.append({'offset' : offset, 'line' : n, 'state' : state.snapshot()})
+            continue
+        state.update(line)
+        offset += (len(line) if line.isascii() else len(line.encode())) + 1
+        n += 1
+        yield line
+
+def unmarked(lines):
+    """ Just the lines of a stream, without its group markers """
+    for line in lines:
+        if line is not GROUP:
+            yield line
+
+def reentry(state, clearance, travel, lift):
+    """ Lines that get the machine from wherever it is back into state, safely: up to the clearance heights (a dict
+    of axis heights), pick up the tool, rapid over at the travel feed, and come back down at the lift feed """
+    position = state['position']
+    yield "; Clear, pick up the tool, and rapid back to where we left off"
+    yield f"G0 {' '.join(a + str(v) for a,v in clearance.items())} F{lift}"
+    if state['tool'] is not None:
+        yield f"T{state['tool']}"
+    if 'X' in position and 'Y' in position:
+        yield move("G0", [position['X'], position['Y']], travel)
+    heights = ' '.join(f"{a}{v:g}" for a,v in position.items() if a not in 'XY')
+    if heights:
+        yield f"G0 {heights} F{lift}"
+    if state['mode'] is not None and state['feed'] is not None:
+        yield f"{state['mode']} F{state['feed']:g}"
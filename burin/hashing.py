@@ -0,0 +1,68 @@
+""" Content hashes for deciding when a unit's output is stale. A unit's hash covers the geometry on
+its layers, the parameters declared by it and every unit before it, the source of the process class and of
+burin itself (code generation lives there too), and the conversion, geometry, and output parameters it runs
+with. """
+
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+
+def layer_hashes(dxf_entities):
+    """ Hash the loaded geometry on each layer """
+    return {layer : hashlib.sha256(pickle.dumps(entities, protocol = 4)).hexdigest()
+            for layer, entities in dxf_entities.items()}
+
+
+def process_source(proc):
+    acc = []
+    for cls in type(proc).__mro__:
+        if cls is object:
+            continue
+        try:
+            acc.append(inspect.getsource(cls))
+        except (OSError, TypeError):
+            acc.append(cls.__qualname__)
+    return acc
+
+
+@functools.lru_cache(maxsize = None)
+def library_hash():
+    """ Hash the source of every module in burin - it can't change while we're running """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))):
+        with open(path, 'rb') as f:
+            digest.update(os.path.basename(path).encode() + b'\0' + f.read() + b'\0')
+    return digest.hexdigest()
+
+
+def unit_hash(proc, state, unit, hashes):
+    """ Hash everything that goes into a unit. Processes should already have their parameters, units, and
+    stage set, and hashes is the output of layer_hashes. """
+    units, stage = state['units'], state['stage']
+    record = units[stage[unit]]
+
+    # Only the parameters that were asked for - processes are free to stash other things in there
+    parameters = []
+    for u in units[0:stage[unit] + 1]:
+        scope = state['parameters'].get(u['name'], {})
+        parameters.append([u['name'], [[p, scope.get(p)] for p in u['parameters']]])
+
+    subunits = []
+    for subname, layers in record['subunits']:
+        subunits.append([subname, [[l, hashes.get(l)] for l in layers],
+                         proc.geometry_parameters((unit, subname))])
+
+    blob = {'unit' : record,
+            'parameters' : parameters,
+            'subunits' : subunits,
+            'conversion' : proc.conversion_parameters(),
+            'output' : proc.output_parameters(unit),
+            'process' : process_source(proc),
+            'library' : library_hash()}
+    
+    return hashlib.sha256(json.dumps(blob, sort_keys = True, default = repr).encode()).hexdigest()
@@ -1,4 +1,4 @@
-import burin.types
+import burin.toolpath as toolpath
 import pewpew.laser_events as l
 
 from dataclasses import dataclass
@@ -23,6 +23,7 @@ class MachineParameters:
     repetition_range : (float, float)
     field_size : float
     travel_speed : float
+    chord_error : float = 2e-4 # How far chords may stray from arcs, as a fraction of the field size
 
 
 def generate_unit(pass_parameters, machine_parameters, geometry):
@@ -53,21 +54,65 @@ def generate_unit(pass_parameters, machine_parameters, geometry):
         # No need to wobble for preview passes...
         yield l.wobble_off()
 
-    events = []
-    
-    for segments in geometry:
-        for segment in segments:
-
-            if isinstance(segment, burin.types.Polyline) or isinstance(segment, burin.types.BSpline):
-                coords = segment.linearize_for_drawing() if isinstance(segment, burin.types.BSpline) else segment.coords
-                
-                for i in range(1, coords.shape[0]):
-                    events.append(l.line(coords[i-1] / size, coords[i] / size, speed = pass_parameters.speed / size))
-                    
-            elif isinstance(segment, burin.types.Arc):
-                coords = np.array(list(segment.linearize_to(0.1)))
-                for i in range(1, coords.shape[0]):
-                    events.append(l.line(coords[i-1] / size, coords[i] / size, speed = pass_parameters.speed / size))
+    # Feeds are in mm/min - speeds in mm/s
+    paths = toolpath.compile_batches(geometry, 60 * machine_parameters.travel_speed, 60 * pass_parameters.speed)
+    kept = []
+
+    def first_pass():
+        # Geometry is compiled a batch at a time, as the first pass needs it. Later passes have to go over all of
+        # it again, so they keep the arrays (not the events) - and share them, so memory doesn't grow with the
+        # number of passes
+        for path in paths:
+            lines = toolpath_lines(path, size, machine_parameters.chord_error * size, pass_parameters.point_time)
+            check_field(*lines, slack = machine_parameters.chord_error)
+            if pass_parameters.passes > 1:
+                kept.append(lines)
+            yield from line_events(*lines)
+
+    repeats = (line_events(*lines) for _ in range(pass_parameters.passes - 1) for lines in kept)
+    events = itertools.chain(first_pass(), itertools.chain.from_iterable(repeats))
                     
-    yield from l.adjust_delays(itertools.chain(*(pass_parameters.passes * [events])), machine_parameters.travel_speed)
+    yield from l.adjust_delays(events, machine_parameters.travel_speed)
+
+
+def toolpath_lines(path, size, tolerance, point_time = None):
+    """ Every line to mark for a burin.toolpath.Toolpath, in field coordinates: arrays of starts, ends, and
+    speeds. Arcs are split into chords that stay within tolerance (mm) of them, and jumps between lines are left to
+    adjust_delays.
+
+    Points (dwells) are held for their dwell time, or point_time if they don't have one - or left out, if neither
+    is set. With only line events to work with, a point is a line tolerance long, at whatever speed takes that
+    long. """
+    starts, ends, rows = path.chords(tolerance)
+    # Joins between segments that already meet don't need marking
+    keep = np.any(starts != ends, axis = 1)
+    starts, ends, rows = starts[keep], ends[keep], rows[keep]
+    speeds = path.feed[rows] / 60
+
+    dwells = np.flatnonzero(path.op == toolpath.DWELL)
+    seconds = path.dwell[dwells]
+    if point_time is not None:
+        seconds = np.where(np.isnan(seconds), point_time, seconds)
+    dwells, seconds = dwells[seconds > 0], seconds[seconds > 0]
+    if len(dwells):
+        points = path.xy[dwells]
+        order = np.argsort(np.concatenate([rows, dwells]), kind = 'stable')
+        starts = np.concatenate([starts, points])[order]
+        ends = np.concatenate([ends, points + [tolerance, 0.0]])[order]
+        speeds = np.concatenate([speeds, tolerance / seconds])[order]
+
+    return starts / size, ends / size, speeds / size
+
+def check_field(starts, ends, speeds, slack = 0.0):
+    """ Make sure every line of toolpath_lines' arrays is inside the field, which runs from -0.5 to 0.5 - geometry
+    too big for it has to be tiled first (see burin.tiling). slack allows for points, which are marked as a short
+    line from where they are. """
+    for name, xy in (('start', starts), ('end', ends)):
+        outside = np.flatnonzero(np.any(np.abs(xy) > 0.5 + slack + 1e-9, axis = 1))
+        if len(outside):
+            raise ValueError(f"Line {outside[0]} {name}s at {xy[outside[0]].tolist()}, outside the field")
 
+def line_events(starts, ends, speeds):
+    """ A line event for every row of toolpath_lines' arrays """
+    for start, end, speed in zip(starts, ends, speeds.tolist()):
+        yield l.line(start, end, speed = speed)
@@ -0,0 +1,86 @@
+""" Writing output files: in big batches rather than a write per line, optionally compressed, and atomically -
+everything goes to a temporary file next to the real one, which is only renamed into place once it's complete, so
+an interrupted run never leaves a half-written file behind (or clobbers the last good one). """
+
+import bz2
+import contextlib
+import gzip
+import itertools
+import lzma
+import os
+import uuid
+
+try:
+    # Only in the standard library from Python 3.14 on
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+BATCH = 16384
+
+def _gzip(f):
+    # No timestamp, so that the same output always makes the same file
+    return gzip.GzipFile(fileobj = f, mode = 'wb', compresslevel = 6, mtime = 0)
+
+COMPRESSORS = {'gzip' : ('.gz', _gzip),
+               'bz2' : ('.bz2', lambda f: bz2.BZ2File(f, 'wb')),
+               'lzma' : ('.xz', lambda f: lzma.LZMAFile(f, 'wb'))}
+if zstd is not None:
+    COMPRESSORS['zstd'] = ('.zst', lambda f: zstd.ZstdFile(f, 'wb'))
+
+READERS = {'.gz' : gzip.open, '.bz2' : bz2.open, '.xz' : lzma.open}
+if zstd is not None:
+    READERS['.zst'] = zstd.open
+
+
+def suffix(compression):
+    """ The file extension for a compression method (None for none) """
+    if compression is None:
+        return ''
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression '{compression}' - try one of {', '.join(COMPRESSORS)}")
+    return COMPRESSORS[compression][0]
+
+@contextlib.contextmanager
+def atomic(path):
+    """ Yields a temporary path to write to in place of path, which is renamed over path if everything
+    succeeds, and deleted otherwise """
+    # Not mkstemp, which makes files only we can read - this gets the permissions open would have given a new
+    # file, and an existing file keeps its own
+    while True:
+        tmp = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.' + uuid.uuid4().hex[:8])
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        if os.path.exists(path):
+            os.fchmod(fd, os.stat(path).st_mode & 0o7777)
+    finally:
+        os.close(fd)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def write_lines(path, lines, compression = None):
+    """ Write a stream of lines (without newlines) to path, joining them into large chunks before each write """
+    lines = iter(lines)
+    with atomic(path) as tmp, open(tmp, 'wb') as raw:
+        f = COMPRESSORS[compression][1](raw) if compression is not None else raw
+        with f:
+            while True:
+                batch = list(itertools.islice(lines, BATCH))
+                if not batch:
+                    break
+                batch.append('')
+                f.write('\n'.join(batch).encode())
+
+def read_bytes(path):
+    """ The contents of a file written by write_lines, decompressed according to its extension """
+    opener = READERS.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as f:
+        return f.read()
@@ -2,23 +2,68 @@ from scipy.spatial import KDTree
 import numpy as np
 import math
 from burin.types import pointwise_equal
+from burin.profile import NullProfiler
+import burin.tiling as tiling
 
 
-def clean_paths(paths, link = True, reverse = True, deduplicate = True, merge = True):
+def gather(paths):
+    """ Stages that have to see every path before they can produce anything (deduplication, linking)
+    say so by gathering their input - everything else in the pipeline streams. """
+    return paths if isinstance(paths, list) else list(paths)
 
 
+def clean_paths(paths, link = True, reverse = True, deduplicate = True, merge = True, tile = None, order = 'travel',
+                timing = None, report = None, profiler = None, name = None):
+    """ Deduplicate, link, and merge paths, returning an iterator over groups of paths. Deduplication and
+    linking gather their input, but merging streams - so the groups are produced as the consumer asks for
+    them. If a profiler (see burin.profile) is provided, each step runs to completion and is recorded as a
+    stage of the (unit, subunit) name.
+
+    tile, if given, is a dict of the 'size', 'overlap', and 'tolerance' to split deduplicated paths into tiles
+    with (see burin.tiling.split) - each tile is then linked and merged on its own, and its groups are preceded
+    by its burin.tiling.Tile.
+
+    order is 'travel' to link paths for a plotter, or 'galvo' to link them for a galvo (see burin.galvo), with
+    timing in place of burin.galvo.TIMING if it's given. report, if it's a dict, gets the cycle times of the two
+    orders for a galvo - for tiled paths, they end up in each Tile's record. """
+    
+    profiler = profiler if profiler is not None else NullProfiler()
+
     if deduplicate:
-        paths = list(remove_duplicates(paths))
+        with profiler.stage(name, 'dedupe') as record:
+            paths = remove_duplicates(gather(paths))
+            if profiler.enabled:
+                paths = gather(paths)
+                record['items'] = len(paths)
+
+    if tile is not None:
+        clean = lambda contents, report: clean_paths(contents, link, reverse, False, merge, None, order, timing, report,
+                                                     profiler, name)
+        return tiling.tiled_groups(gather(paths), tile['size'], tile.get('overlap', 0.0), tile.get('tolerance', 0.01), clean)
 
 
     if link:
-        paths = list(link_paths(paths, reverse = reverse))
+        with profiler.stage(name, 'link') as record:
+            if order == 'galvo':
+                # burin.galvo builds on this module
+                import burin.galvo as galvo
+                paths = galvo.link_paths(gather(paths), reverse, timing if timing is not None else galvo.TIMING, report)
+            else:
+                paths = link_paths(gather(paths), reverse = reverse)
+            if profiler.enabled:
+                paths = gather(paths)
+                record['items'] = len(paths)
 
-    
-    if merge is not None:
-        return list(merge_paths(paths, merge))
-    else:
-        return list([p] for p in paths)
+    with profiler.stage(name, 'merge') as record:
+        if merge is not None:
+            groups = merge_paths(paths, merge)
+        else:
+            groups = ([p] for p in paths)
+        if profiler.enabled:
+            groups = list(groups)
+            record['items'] = len(groups)
+        
+    return groups
 
 
     
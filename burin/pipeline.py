@@ -0,0 +1,289 @@
+""" The whole burin workflow as a Python object, for driving jobs without going through the CLI.
+
+A Pipeline holds the workflow state (what run_burin keeps in state.json), an instance of the process,
+and the loaded dxf geometry. Geometry is parsed once and kept around, along with everything cached on
+it (like flattened block definitions), so running many units - or re-running them - doesn't reload
+anything. The stages map onto the CLI's flow:
+
+    p = Pipeline.start('part.dxf', 'laser.DefaultLaser', 'out')   # start
+    p.load()                                                      # parse the dxf
+    for unit in p.units():
+        p.parameters(unit)                                        # check (or prompt for) parameters
+        p.run(unit)                                               # flatten, clean, generate, and write
+
+flatten, clean, and generate are also available individually. Without a directory, nothing
+is written to disk - use generate to get at the output. """
+
+import importlib
+import json
+import os
+import shutil
+
+import burin.dxfloader as dxfloader
+import burin.hashing as hashing
+import burin.scheduler as scheduler
+from burin.profile import NullProfiler
+
+
+class PipelineError(Exception):
+    pass
+
+
+def load_state(directory):
+    blob = os.path.join(directory,"state.json")
+    if not os.path.exists(blob):
+        raise PipelineError(f"Unable to find workflow state {blob}")
+    with open(blob,"r") as f:
+        return json.load(f)
+
+def save_state(directory, blob):
+    # Make sure that the output directory is actually a thing
+    if not os.path.exists(directory):
+        os.mkdir(directory)
+    elif not os.path.isdir(directory):
+        raise PipelineError(f"Output directory '{directory}' already exists, but is not a directory")
+
+    blob_path = os.path.join(directory,"state.json")
+    with open(blob_path,'w') as f:
+        json.dump(blob, f)
+
+    return blob_path
+
+def load_process(process):
+    splat = process.split('.')
+    module,clss = '.'.join(splat[:-1]), splat[-1]
+
+    try:
+        mod = importlib.import_module(module)
+    except ImportError:
+        raise PipelineError(f"Unable to find module {module}")
+
+    if clss not in mod.__dict__:
+        raise PipelineError(f"Unable to find process {clss} in module {module}")
+
+    return mod.__dict__[clss]()
+
+
+def check_parameters(blob, unit, prompt = None, reset = False):
+    """ Make sure every parameter needed by a unit (and all of the units before it) is present.
+    prompt, if provided, is called as prompt(unit, parameter) to fill in missing values. """
+
+    stages, parameters, units = blob['stage'], blob['parameters'], blob['units']
+    ok,updated = True,False
+
+    # If we're resetting parameters for this layer, purge the old ones
+    if reset and (unit in parameters):
+        parameters[unit] = {}
+        updated = True
+    # Go through all of the previous units (+ the current) and make
+    # sure all of the required parameters are there
+    for i in range(0, 1 + stages[unit]):
+        u = units[i]
+        name = u['name']
+        if name not in parameters:
+            parameters[name] = {}
+        scope = parameters[name]
+        for p in u['parameters']:
+            if p not in scope:
+                if prompt is not None:
+                    scope[p] = prompt(name, p)
+                    updated = True
+                else:
+                    ok = False
+
+    return ok, updated
+
+
+class Pipeline:
+
+    def __init__(self, state, directory = None, source = None, process = None):
+        self.state = state
+        self.directory = directory
+        self.source = source if source is not None else os.path.join(directory, 'input.dxf')
+        self.process = process if process is not None else load_process(state['process'])
+        # Give the process a little context as to what's happening
+        self.process.parameters = state['parameters']
+        self.process.units = state['units']
+        self.process.stage = state['stage']
+
+        self.conversion = self.process.conversion_parameters()
+        self.dxf_entities = None
+        self.layer_hashes = {}
+
+    @staticmethod
+    def start(filepath, process, directory = None):
+        """ Set up a new workflow for a dxf file - if there's a directory, the file is copied into it
+        and the state is saved there """
+        if not os.path.exists(filepath):
+            raise PipelineError(f"Input file {filepath} doesn't exist")
+
+        proc = load_process(process) if isinstance(process, str) else process
+        units = proc.layers_to_units(dxfloader.load_layers(filepath))
+        if units is None:
+            raise PipelineError(f"Process {process} can't handle the layers in {filepath}")
+
+        # Make sure we didn't declare any units twice...
+        stage = {}
+        for i,u in enumerate(units):
+            if u['name'] in stage:
+                raise PipelineError(f"Invalid process - unit {u['name']} declared twice")
+            stage[u['name']] = i
+
+        name = process if isinstance(process, str) else f"{type(proc).__module__}.{type(proc).__qualname__}"
+        blob = {'process' : name, 'units' : units, 'parameters' : {}, 'stage': stage}
+
+        if directory is None:
+            return Pipeline(blob, source = filepath, process = proc)
+
+        save_state(directory, blob)
+        shutil.copy(filepath, os.path.join(directory, 'input.dxf'))
+        return Pipeline(blob, directory, process = proc)
+
+    @staticmethod
+    def open(directory):
+        """ Pick up a workflow from a directory set up by start """
+        return Pipeline(load_state(directory), directory)
+
+    def save(self):
+        if self.directory is not None:
+            return save_state(self.directory, self.state)
+
+    def units(self):
+        return [u['name'] for u in self.state['units']]
+
+    def subunits(self, unit):
+        return self.record(unit)['subunits']
+
+    def record(self, unit):
+        if unit not in self.state['stage']:
+            raise PipelineError(f"Can't find unit {unit}")
+        return self.state['units'][self.state['stage'][unit]]
+
+    def parameters(self, unit = None, prompt = None, reset = False):
+        """ Check that a unit (and all before it) has its parameters - or every unit, if unit is None. Missing
+        values are filled in by prompt(unit, parameter) if provided, otherwise they raise a PipelineError. """
+        unit = unit if unit is not None else self.units()[-1]
+        self.record(unit)
+        ok, new = check_parameters(self.state, unit, prompt, reset)
+        if new:
+            self.save()
+        if not ok:
+            raise PipelineError(f"Unspecified parameters for unit {unit}")
+        return self.state['parameters'][unit]
+
+    def set_parameters(self, unit, **values):
+        self.record(unit)
+        self.state['parameters'].setdefault(unit, {}).update(values)
+        self.save()
+
+    def load(self, source = None):
+        """ Parse the dxf (replacing the input file with source, if provided), keeping every layer any unit
+        uses. Returns the sorted names of the layers whose geometry changed since the last load. """
+        if source is not None:
+            if self.directory is not None:
+                shutil.copy(source, os.path.join(self.directory, 'input.dxf'))
+            else:
+                self.source = source
+
+        layers = set()
+        for record in self.state['units']:
+            layers = layers.union(*(set(x) for _,x in record['subunits']))
+
+        dxf_entities, errors = dxfloader.load_entities(self.source, layers, arcs = self.conversion['arcs'])
+        if errors:
+            raise PipelineError("Error loading dxf:\n" + '\n'.join("    " + x[0] for x in errors))
+
+        hashes = hashing.layer_hashes(dxf_entities)
+        previous = self.layer_hashes
+        self.dxf_entities, self.layer_hashes = dxf_entities, hashes
+
+        return sorted(l for l in set(hashes) | set(previous) if hashes.get(l) != previous.get(l))
+
+    def entities(self):
+        if self.dxf_entities is None:
+            self.load()
+        return self.dxf_entities
+
+    def flatten(self, unit, subunit, render = dxfloader.render_entities):
+        """ The segments of one subunit, before the process or the path cleaner have touched them """
+        entities = []
+        for layer in dict(self.subunits(unit))[subunit]:
+            entities += self.entities().get(layer, [])
+        return render(entities, self.conversion['resolution'])
+
+    def clean(self, unit, subunit, render = dxfloader.render_entities, profiler = NullProfiler()):
+        """ Flattened, modified, and cleaned (deduplicated, linked, and merged) geometry for a subunit """
+        layers = dict(self.subunits(unit))[subunit]
+        return scheduler.subunit_geometry(self.process, (unit, subunit), layers, self.entities(),
+                                          self.conversion['resolution'], render, profiler)
+
+    def generate(self, unit, render = dxfloader.render_entities, profiler = NullProfiler()):
+        """ Output for a whole unit, as a stream of whatever the process generates """
+        for subname, _ in self.subunits(unit):
+            full_name = unit, subname
+            optimized = self.clean(unit, subname, render, profiler)
+            with profiler.stage(full_name, 'generate') as record:
+                events = self.process.generate_code(full_name, optimized)
+                # To measure generation on its own, we have to run it to completion here
+                if profiler.enabled:
+                    events = [*events]
+                    record['items'] = len(events)
+            yield from events
+
+    def content_hash(self, unit):
+        self.entities()
+        return hashing.unit_hash(self.process, self.state, unit, self.layer_hashes)
+
+    def up_to_date(self, unit, content_hash = None):
+        content_hash = content_hash if content_hash is not None else self.content_hash(unit)
+        return (self.state.get('hashes', {}).get(unit) == content_hash and
+                os.path.exists(self.process.output_file(self.directory, unit)))
+
+    def run(self, unit, force = False, render = dxfloader.render_entities, profiler = NullProfiler()):
+        """ Generate and write a unit's output, unless it's up to date. Returns True if the output was regenerated. """
+        if self.directory is None:
+            raise PipelineError("Can't write output without a directory - use generate instead")
+
+        content_hash = self.content_hash(unit)
+        if not force and self.up_to_date(unit, content_hash):
+            return False
+
+        events = self.generate(unit, render, profiler)
+        if profiler.enabled:
+            events = [*events]
+        with profiler.stage((unit, None), 'write') as record:
+            self.process.write_file(self.directory, unit, events)
+            if profiler.enabled:
+                record['items'] = len(events)
+
+        # After processing the geometry, we may have changed parameters
+        self.state.setdefault('hashes', {})[unit] = content_hash
+        self.save()
+        return True
+
+    def summary(self, unit):
+        """ What the process has to say about a unit's output (see BaseProcess.summary), or None """
+        return self.process.summary(self.directory, unit)
+
+    def run_parallel(self, jobs, force = False, finished = None):
+        """ Run every unit (that isn't up to date) in a pool of jobs processes - see burin.scheduler. Every parameter
+        must already be present. Returns the units that were up to date. """
+        if self.directory is None:
+            raise PipelineError("Can't write output without a directory")
+        self.parameters()
+
+        hashes = {u : self.content_hash(u) for u in self.units()}
+        skip = set()
+        if not force:
+            skip = set(u for u, h in hashes.items() if self.up_to_date(u, h))
+
+        def done(unit):
+            self.state.setdefault('hashes', {})[unit] = hashes[unit]
+            self.save()
+            if finished is not None:
+                finished(unit)
+
+        scheduler.run_units(self.process, self.state, self.directory, self.entities(),
+                            self.conversion['resolution'], jobs, done, skip)
+        self.save()
+        return skip
@@ -1,5 +1,10 @@
+import itertools
+import json
 import os
 
+import burin.gcode as gcode
+import burin.output as output
+
 def cannonical_order(layers):
     """ Take a bunch of layer names, and sort them consistently - first, all of the
     layer names that are parsable as integers, in ascending order. Then, the rest of the layer names,
@@ -16,15 +21,53 @@ def cannonical_order(layers):
 
 
 
+def peek(segments):
+    """ Code generators get an iterator of groups, not a list - this returns the first group (or None
+    if there aren't any), and an iterator that still includes it """
+    segments = iter(segments)
+    first = next(segments, None)
+    if first is None:
+        return None, segments
+    return first, itertools.chain([first], segments)
+
+
 class BaseProcess:
 
     def __init__(self):
         self.parameters = {}
 
+    def output_file(self, directory, unit):
+        return os.path.join(directory, unit + ".gcode" + output.suffix(self.output_parameters(unit)['compression']))
+
+    def index_file(self, directory, unit):
+        """ Where the byte offset and machine state of every group in a unit's output is kept (see resume) """
+        return self.output_file(directory, unit) + ".index.json"
+
     def write_file(self, directory, unit, events):
-        with open(os.path.join(directory, unit + ".gcode"),'w') as f:
-            for x in events:
-                f.write(x + '\n')
+        parameters = self.output_parameters(unit)
+        groups = []
+        output.write_lines(self.output_file(directory, unit), gcode.indexed(events, groups), parameters['compression'])
+        with output.atomic(self.index_file(directory, unit)) as tmp, open(tmp, 'w') as f:
+            json.dump({'groups' : groups}, f)
+
+    def summary(self, directory, unit):
+        """ Anything worth telling the user about a unit's output once it's written, or None. Units can be written by
+        worker processes, so this reads it back from the output rather than being told as it's written. """
+        return None
+
+    def resume_preamble(self, unit_name, state):
+        """ G-code to get the machine safely back into state (a snapshot from burin.gcode.MachineState), before
+        carrying on from the middle of a unit's output. Defaults to burin.codegen.GCodeGen's heights and speeds. """
+        import burin.codegen
+        cg = burin.codegen.GCodeGen()
+        clearance = {'Z' : cg.heights['z_clearance'], 'V' : cg.heights['v_clearance']}
+        return gcode.reentry(state, clearance, cg.speeds['travel'], cg.speeds['z'])
+
+    def output_parameters(self, unit_name):
+        """ How should a unit's output be written - 'modal' drops G-code words that repeat the controller's
+        current state (code generators pass it on to burin.gcode.translate), and 'compression' is None, or one of
+        burin.output.COMPRESSORS """
+        return {'modal' : True, 'compression' : None}
 
         
     def conversion_parameters(self):
@@ -60,10 +103,19 @@ class BaseProcess:
                 'deduplicate' : True, 'merge' : 0.1}
 
     def generate_code(self, unit_name, segments):
-        """ Generate a stream of gcode from a list of numpy array path segments """
+        """ Generate a stream of gcode from an iterator over groups of path segments. Groups arrive as
+        they're produced, so this should consume them in a single pass (see peek), holding on to as few as it
+        can - burin.toolpath.batched compiles them a bounded batch at a time. """
         yield "; Nothing to see here!"
 
 
+    def unit_dependencies(self, unit_name):
+        """ Which units have to be finished before this one can run? Only consulted when running units
+        in parallel - the default is strictly in order, as units may depend on parameters set by earlier ones.
+        Units running in parallel should only change their own scope of self.parameters. """
+        i = self.stage[unit_name]
+        return [self.units[i - 1]['name']] if i > 0 else []
+
     # No need to override this for customization
     def subunit_position(self,name):
         """ Returns a pair of booleans, indicating if the specified subunit is the first (1st return value),
@@ -0,0 +1,85 @@
+""" Per-stage instrumentation for the unit pipeline - wall time, CPU time, peak traced allocation
+(via tracemalloc), and a count of whatever the stage produced. Optionally keeps a cProfile of each
+stage, and dumps the one for the slowest stage. Profiling is only meaningful relative to other
+profiled runs: tracemalloc (and cProfile, even more so) slow everything down. """
+
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+
+class NullProfiler:
+    """ Stands in when nothing is being measured """
+    enabled = False
+    
+    @contextlib.contextmanager
+    def stage(self, name, stage):
+        yield {}
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, cprofile = False):
+        self.records = []
+        self.profiles = []
+        self.cprofile = cprofile
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+        
+    @contextlib.contextmanager
+    def stage(self, name, stage):
+        """ Measure a stage for a (unit, subunit) name - subunit is None for unit-wide stages.
+        The yielded record's 'items' can be set to count what the stage produced. """
+        unit, subunit = name
+        record = {'unit' : unit, 'subunit' : subunit, 'stage' : stage, 'items' : None}
+        profile = cProfile.Profile() if self.cprofile else None
+
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            record['peak'] = tracemalloc.get_traced_memory()[1] - base
+            self.records.append(record)
+            self.profiles.append(profile)
+
+    def table(self):
+        lines = [f"{'subunit':<16} {'stage':<10} {'wall (s)':>10} {'cpu (s)':>10} {'peak (MB)':>10} {'items':>10}"]
+        for r in self.records:
+            items = '' if r['items'] is None else str(r['items'])
+            sub = '-' if r['subunit'] is None else str(r['subunit'])
+            lines.append(f"{sub:<16} {r['stage']:<10} {r['wall']:>10.3f} {r['cpu']:>10.3f} {r['peak'] / 2**20:>10.2f} {items:>10}")
+        total = sum(r['wall'] for r in self.records)
+        lines.append(f"{'total':<27} {total:>10.3f}")
+        return '\n'.join(lines)
+
+    def write(self, directory, unit):
+        """ Write [unit].profile.json, [unit].profile.txt and, if we have one, a cProfile
+        dump for the slowest stage as [unit].prof. Returns the paths written. """
+        base = os.path.join(directory, unit)
+        with open(base + '.profile.json', 'w') as f:
+            json.dump(self.records, f, indent = 1)
+        with open(base + '.profile.txt', 'w') as f:
+            f.write(self.table() + '\n')
+        paths = [base + '.profile.json', base + '.profile.txt']
+
+        if self.cprofile and self.records:
+            hottest = max(range(len(self.records)), key = lambda i: self.records[i]['wall'])
+            self.profiles[hottest].dump_stats(base + '.prof')
+            paths.append(base + '.prof')
+        return paths
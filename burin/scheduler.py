@@ -0,0 +1,93 @@
+""" Running the units of a workflow concurrently. Units (and the subunits inside them) are handed
+to a process pool as soon as every unit they depend on has finished. The dxf file is parsed once,
+in the parent, and handed to each worker as it starts. """
+
+import concurrent.futures
+
+import burin.path as pathcleaner
+import burin.dxfloader as dxfloader
+from burin.profile import NullProfiler
+
+
+def subunit_geometry(proc, name, layers, dxf_entities, resolution, render = dxfloader.render_entities,
+                     profiler = NullProfiler()):
+    """ Flatten, modify, and clean up all of the geometry for one subunit - returns an iterator over groups """
+    entities = []
+    for layer in layers:
+        entities += dxf_entities.get(layer, [])
+
+    with profiler.stage(name, 'flatten') as record:
+        geo = render(entities, resolution)
+        record['items'] = len(geo)
+    with profiler.stage(name, 'modify') as record:
+        geo = proc.modify_geometry(name, geo)
+        record['items'] = len(geo)
+    return pathcleaner.clean_paths(geo, **proc.geometry_parameters(name), profiler = profiler, name = name)
+
+
+# Set once in every worker by share_entities
+_entities, _resolution = None, None
+
+def share_entities(dxf_entities, resolution):
+    global _entities, _resolution
+    _entities, _resolution = dxf_entities, resolution
+
+def geometry_task(proc, name, layers):
+    # The geometry has to cross back to the parent, so it can't stream
+    optimized = list(subunit_geometry(proc, name, layers, _entities, _resolution))
+    return optimized, proc.parameters.get(name[0], {})
+
+def write_task(proc, directory, unit, geometry):
+    subunits = proc.units[proc.stage[unit]]['subunits']
+    
+    def seg_gen():
+        for (subname, _), optimized in zip(subunits, geometry):
+            yield from proc.generate_code((unit, subname), optimized)
+            
+    proc.write_file(directory, unit, seg_gen())
+    return None, proc.parameters.get(unit, {})
+
+
+def run_units(proc, state, directory, dxf_entities, resolution, jobs, finished = None, skip = ()):
+    """ Run every unit in state through a pool of jobs processes. Any changes a unit makes to its own
+    parameter scope are merged back into state['parameters'] before anything that depends on it starts, and
+    finished(unit) is called (in this process) as each unit's output is written. Units in skip are treated
+    as already finished. """
+
+    names = [u['name'] for u in state['units']]
+    dependencies = {u : set(proc.unit_dependencies(u)) for u in names}
+    pending, done = [u for u in names if u not in skip], set(skip)
+    geometry, futures = {}, {}
+
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer = share_entities,
+                                                initargs = (dxf_entities, resolution)) as pool:
+        while pending or futures:
+            
+            for unit in [u for u in pending if dependencies[u] <= done]:
+                pending.remove(unit)
+                subunits = state['units'][state['stage'][unit]]['subunits']
+                geometry[unit] = [None] * len(subunits)
+                for i, (subname, layers) in enumerate(subunits):
+                    f = pool.submit(geometry_task, proc, (unit, subname), layers)
+                    futures[f] = unit, i
+
+            if not futures:
+                raise ValueError(f"Unsatisfiable unit dependencies: {', '.join(pending)}")
+
+            complete, _ = concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+            
+            for f in complete:
+                unit, i = futures.pop(f)
+                result, scope = f.result()
+                state['parameters'].setdefault(unit, {}).update(scope)
+                
+                if i is None:
+                    done.add(unit)
+                    if finished is not None:
+                        finished(unit)
+                    continue
+                
+                geometry[unit][i] = result
+                if all(x is not None for x in geometry[unit]):
+                    f = pool.submit(write_task, proc, directory, unit, geometry.pop(unit))
+                    futures[f] = unit, None
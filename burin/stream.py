@@ -0,0 +1,180 @@
+""" Sending G-code straight to a controller as it's generated, rather than writing a file and uploading it.
+
+Controllers that take G-code over a socket (a serial bridge, or FakeController below) speak a plain line protocol:
+one line of G-code in, one reply line out - 'ok' once the line has been accepted, anything else is an error. Lines
+are sent through a bounded window: up to `window` of them can be in flight before we wait for acknowledgements,
+which are read by a separate task as they arrive. That keeps the controller's queue full without letting us run
+arbitrarily far ahead of it - and as lines are pulled from the generator only when there's room for them, the
+machine starts moving long before generation finishes.
+
+Duet controllers running DSF are reached through machine_interface.MachineConnection (as in PlaneTracker.py), which
+takes blocks of lines - send_to_machine sends a window's worth at a time from a background thread.
+
+For testing, FakeController acknowledges everything (after an optional delay per line, to play at being a slow
+machine) and keeps what it was sent. """
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import os
+
+DSF_SOCKET = '/var/run/dsf/dcs.sock'
+
+
+class StreamError(Exception):
+    pass
+
+
+def sendable(lines):
+    """ Strip comments and blank lines - the controller would only throw them away """
+    for line in lines:
+        line = line.split(';', 1)[0].strip()
+        if line:
+            yield line
+
+def split_address(address):
+    """ 'host:port' for TCP, anything else is the path to a unix socket """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in host:
+        return host or 'localhost', int(port)
+    return address, None
+
+async def open_connection(address):
+    host, port = split_address(address)
+    if port is None:
+        return await asyncio.open_unix_connection(host)
+    return await asyncio.open_connection(host, port)
+
+
+async def send_lines(lines, reader, writer, window = 16, progress = None):
+    """ Send lines over an open connection, keeping at most window of them unacknowledged. progress, if
+    provided, is called with the number of lines acknowledged so far as acknowledgements arrive.
+    Returns the number of lines sent. """
+
+    pending = collections.deque()
+    room = asyncio.Semaphore(window)
+    acknowledged = 0
+
+    async def acknowledgements():
+        nonlocal acknowledged
+        while True:
+            reply = await reader.readline()
+            if not reply:
+                raise StreamError("Controller closed the connection")
+            line, reply = pending.popleft(), reply.decode().strip()
+            if not reply.startswith('ok'):
+                raise StreamError(f"Controller rejected '{line}': {reply}")
+            acknowledged += 1
+            room.release()
+            if progress is not None:
+                progress(acknowledged)
+
+    async def wait_for(task, acks):
+        # Whatever we're waiting on, stop if the acknowledgement reader falls over
+        task = asyncio.ensure_future(task)
+        await asyncio.wait([task, acks], return_when = asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            acks.result()
+        return task.result()
+
+    acks = asyncio.create_task(acknowledgements())
+    sent = 0
+    try:
+        for line in sendable(lines):
+            if room.locked():
+                await wait_for(room.acquire(), acks)
+            else:
+                await room.acquire()
+            if acks.done():
+                acks.result()
+            pending.append(line)
+            writer.write((line + '\n').encode())
+            await writer.drain()
+            sent += 1
+        # Wait for the tail end to be acknowledged
+        for _ in range(window):
+            await wait_for(room.acquire(), acks)
+    finally:
+        acks.cancel()
+    return sent
+
+async def stream_to(address, lines, window = 16, progress = None):
+    reader, writer = await open_connection(address)
+    try:
+        return await send_lines(lines, reader, writer, window, progress)
+    finally:
+        writer.close()
+
+def send(address, lines, window = 16, progress = None):
+    """ Stream lines to the controller at address (see split_address), returning the number sent """
+    return asyncio.run(stream_to(address, lines, window, progress))
+
+
+def send_to_machine(lines, window = 16, socket = DSF_SOCKET, progress = None):
+    """ Stream lines to a DSF controller through machine_interface.MachineConnection, a window at a time. The
+    next window is generated while the previous one is being sent. """
+    try:
+        from machine_interface import MachineConnection
+    except ImportError:
+        raise StreamError("machine_interface isn't installed - connect to a controller by address instead")
+
+    sent = 0
+    lines = sendable(lines)
+    with MachineConnection(socket) as m, concurrent.futures.ThreadPoolExecutor(1) as pool:
+        in_flight = None
+        while True:
+            block = list(itertools.islice(lines, window))
+            if in_flight is not None:
+                in_flight.result()
+                if progress is not None:
+                    progress(sent)
+            if not block:
+                break
+            in_flight = pool.submit(m.gcode, block)
+            sent += len(block)
+    return sent
+
+
+class FakeController:
+    """ A stand-in for a controller, for testing: listens on address, acknowledges every line after delay
+    seconds, and remembers the lines in self.received. Lines starting with 'FAIL' get an error instead. """
+
+    def __init__(self, address, delay = 0.0, log = None):
+        self.address, self.delay, self.log = address, delay, log
+        self.received = []
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode().strip()
+                self.received.append(line)
+                if self.log is not None:
+                    self.log.write(line + '\n')
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(b'error: failed\n' if line.startswith('FAIL') else b'ok\n')
+                await writer.drain()
+        finally:
+            writer.close()
+            if self.log is not None:
+                self.log.flush()
+
+    async def start(self):
+        host, port = split_address(self.address)
+        if port is None:
+            if os.path.exists(host):
+                os.unlink(host)
+            self.server = await asyncio.start_unix_server(self.handle, host)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
@@ -0,0 +1,148 @@
+""" Splitting geometry that's too big for a galvo's field into field-sized tiles, to be marked one after another,
+moving the work under the galvo in between.
+
+Tiles are laid out from the lower left corner of the geometry, a field size less the overlap apart, so that
+neighbouring fields overlap. Each tile owns the square in the middle of its field that's as wide as that pitch (its
+core - the cores of tiles on the edges run out to infinity). Segments that fit inside the field of the tile their
+start lies in are kept whole there, and everything else is clipped to the cores. So everything is marked exactly
+once, and the overlap is slack that keeps small shapes near the edges from being cut in two.
+
+The machine's field is a field size across, centred on the origin - the same frame geometry is marked in when it
+isn't tiled, which is what happens to anything that already fits there. Every tile's geometry is moved so that its
+field lands on the machine's: the tile's offset is where the middle of its field was, which is how far the stage
+has to move the work to mark it. Tiles are visited in serpentine order: along the first row, back along the second,
+and so on, leaving out any that would be empty. """
+
+import itertools
+import math
+import numpy as np
+
+import burin.types
+
+
+class Tile:
+
+    def __init__(self, index, row, column, offset, count = 1):
+        self.index, self.row, self.column, self.offset = index, row, column, offset
+        # How many tiles the unit was split into
+        self.count = count
+        # Anything worth knowing about how the tile's geometry was cleaned up
+        self.report = {}
+
+    def record(self):
+        return dict(self.report, index = self.index, row = self.row, column = self.column, offset = list(self.offset))
+
+
+def bounds(segment):
+    """ Lower left and upper right corners of a box around a segment """
+    if isinstance(segment, burin.types.Arc):
+        a = segment.start - segment.center
+        r = math.sqrt(a.dot(a))
+        return segment.center - r, segment.center + r
+    if isinstance(segment, burin.types.Point):
+        return segment.coords, segment.coords
+    if isinstance(segment, burin.types.BSpline):
+        # A spline stays inside the hull of its control points
+        return segment.pts.min(axis = 0), segment.pts.max(axis = 0)
+    return segment.coords[:,0:2].min(axis = 0), segment.coords[:,0:2].max(axis = 0)
+
+def clip_polyline(coords, lo, hi):
+    """ The pieces of a polyline inside the box [lo, hi) - Liang-Barsky, for every edge at once """
+    a, d = coords[:-1,0:2], np.diff(coords[:,0:2], axis = 0)
+    enter, leave = np.zeros(len(d)), np.ones(len(d))
+    for axis in range(2):
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            s, t = (lo[axis] - a[:,axis]) / d[:,axis], (hi[axis] - a[:,axis]) / d[:,axis]
+        # Edges parallel to a side are either inside the slab or not at all
+        inside = (a[:,axis] >= lo[axis]) & (a[:,axis] < hi[axis])
+        moving = d[:,axis] != 0
+        enter = np.maximum(enter, np.where(moving, np.minimum(s, t), np.where(inside, -np.inf, np.inf)))
+        leave = np.minimum(leave, np.where(moving, np.maximum(s, t), np.where(inside, np.inf, -np.inf)))
+
+    kept = np.flatnonzero(enter < leave)
+    if len(kept) == 0:
+        return []
+    starts, ends = a[kept] + enter[kept,None] * d[kept], a[kept] + leave[kept,None] * d[kept]
+    # A new piece starts wherever consecutive edges don't carry straight on from each other
+    joined = (np.diff(kept) == 1) & (leave[kept[:-1]] == 1) & (enter[kept[1:]] == 0)
+    breaks = np.flatnonzero(~joined) + 1
+    return [np.vstack([s[0:1], e]) for s, e in zip(np.split(starts, breaks), np.split(ends, breaks))]
+
+
+def split(segments, size, overlap = 0.0, tolerance = 0.01):
+    """ Split segments into tiles of a field size across. Returns a list of (Tile, segments) in the order to mark
+    them. Arcs that have to be clipped are flattened to within tolerance first. """
+    if not segments:
+        return []
+    boxes = [bounds(s) for s in segments]
+    lo = np.min([b[0] for b in boxes], axis = 0)
+    hi = np.max([b[1] for b in boxes], axis = 0)
+    if np.all(lo >= -0.5 * size) and np.all(hi <= 0.5 * size):
+        return [(Tile(0, 0, 0, (0.0, 0.0)), segments)]
+
+    pitch = size - overlap
+    if pitch <= 0:
+        raise ValueError(f"Tile overlap ({overlap}) has to be less than the field size ({size})")
+    columns, rows = (max(1, math.ceil((x - overlap) / pitch)) for x in hi - lo)
+
+    def owner(point):
+        i, j = np.clip(np.floor((np.asarray(point[0:2]) - lo - 0.5 * overlap) / pitch), 0, [columns - 1, rows - 1])
+        return int(i), int(j)
+
+    def core(i, j):
+        corner = lo + 0.5 * overlap + pitch * np.array([i, j])
+        return (np.where([i == 0, j == 0], -np.inf, corner),
+                np.where([i == columns - 1, j == rows - 1], np.inf, corner + pitch))
+
+    tiles = {}
+    for segment, (low, high) in zip(segments, boxes):
+        i, j = owner(segment.endpoints()[0])
+        field = lo + pitch * np.array([i, j])
+        if np.all(low >= field) and np.all(high <= field + size):
+            tiles.setdefault((i, j), []).append(segment)
+            continue
+
+        if isinstance(segment, burin.types.Arc):
+            coords = segment.to_polyline(tolerance).coords
+        elif isinstance(segment, burin.types.BSpline):
+            coords = segment.linearize_for_drawing()
+        else:
+            coords = segment.coords
+        (i0, j0), (i1, j1) = owner(low), owner(high)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                pieces = clip_polyline(coords, *core(i, j))
+                if pieces:
+                    tiles.setdefault((i, j), []).extend(burin.types.Polyline(p) for p in pieces)
+
+    order = sorted(tiles, key = lambda ij: (ij[1], ij[0] if ij[1] % 2 == 0 else -ij[0]))
+    ret = []
+    for index, (i, j) in enumerate(order):
+        offset = lo + pitch * np.array([i, j]) + 0.5 * size
+        shift = np.array([[1.0, 0.0, -offset[0]], [0.0, 1.0, -offset[1]]])
+        for segment in tiles[(i, j)]:
+            segment.transform(shift)
+        ret.append((Tile(index, j, i, tuple(offset.tolist()), len(order)), tiles[(i, j)]))
+    return ret
+
+def tiled_groups(segments, size, overlap, tolerance, clean):
+    """ A stream of groups for every tile, each preceded by its Tile. clean(segments, report) turns a tile's
+    segments into groups, and may fill in the tile's report as it does. """
+    for tile, contents in split(segments, size, overlap, tolerance):
+        # The tile has to wait for its groups, so that its report is complete
+        groups = list(clean(contents, tile.report))
+        yield tile
+        yield from groups
+
+def by_tile(stream):
+    """ Undo tiled_groups: (Tile, iterator over what followed it) for each tile in a stream. Anything before the
+    first Tile (all of it, if the stream isn't tiled) comes under None. Like itertools.groupby, nothing is held on
+    to - a tile's iterator has to be used before moving on to the next tile. """
+    current = None
+    def owner(x):
+        nonlocal current
+        if isinstance(x, Tile):
+            current = x
+        return current
+    for tile, contents in itertools.groupby(stream, owner):
+        yield tile, (x for x in contents if not isinstance(x, Tile))
@@ -0,0 +1,212 @@
+""" A compiled toolpath: everything a machine does for a subunit, as one set of flat NumPy arrays, built once from
+the linked groups of segments. Backends (G-code, laser jobs) translate from it an opcode at a time, rather than
+each walking the segments with their own isinstance checks.
+
+Every row is one operation:
+
+* RAPID - travel (tool up, laser off) to xy
+* LINE - draw a straight line to xy
+* ARC_CW, ARC_CCW - draw an arc to xy, around center
+* DWELL - stay at xy (a Point) for dwell seconds - NaN leaves the time up to the backend
+* LIFT, LOWER - raise or lower the tool, without moving
+
+xy is always where a row leaves the tool, so every move starts at the previous row's xy. Feeds are in mm/min, and
+NaN for rows without one, as are the centers of anything but arcs. groups holds the first row of every group.
+
+Code generators get their groups as they're produced, so they compile them a batch at a time (see batched) - a
+subunit's toolpath never has to be held whole, and its first lines come out before its last groups are linked.
+Every batch starts with a rapid, so a batch's toolpath doesn't depend on the one before it. """
+
+import itertools
+import numpy as np
+
+import burin.types
+import burin.arcfit as arcfit
+
+RAPID, LINE, ARC_CW, ARC_CCW, DWELL, LIFT, LOWER = range(7)
+
+# How many groups go into each toolpath, when compiling a stream of them
+BATCH = 1000
+
+
+class Toolpath:
+
+    def __init__(self, op, xy, center, feed, dwell, groups):
+        self.op, self.xy, self.center, self.feed, self.dwell = op, xy, center, feed, dwell
+        self.groups = groups
+
+    def __len__(self):
+        return len(self.op)
+
+    def starts(self):
+        """ Where every row starts - the previous row's xy """
+        return np.concatenate([self.xy[0:1], self.xy[:-1]])
+
+    def arcs(self):
+        """ Which rows are arcs """
+        return (self.op == ARC_CW) | (self.op == ARC_CCW)
+
+    def sweeps(self):
+        """ Signed angles (radians, counterclockwise positive) swept by every arc, and their radii - zero for
+        anything else. An arc that ends where it starts is a full circle. """
+        arcs = self.arcs()
+        a, b = self.starts()[arcs] - self.center[arcs], self.xy[arcs] - self.center[arcs]
+        sweep = np.arctan2(a[:,0] * b[:,1] - a[:,1] * b[:,0], np.einsum('ij,ij->i', a, b))
+        clockwise = self.op[arcs] == ARC_CW
+        sweep = np.where(clockwise & (sweep >= 0), sweep - 2 * np.pi, sweep)
+        sweep = np.where(~clockwise & (sweep <= 0), sweep + 2 * np.pi, sweep)
+
+        sweeps, radii = np.zeros(len(self)), np.zeros(len(self))
+        sweeps[arcs], radii[arcs] = sweep, np.sqrt(np.einsum('ij,ij->i', a, a))
+        return sweeps, radii
+
+    def chords(self, tolerance):
+        """ Everything drawn (lines and arcs) as straight chords, in order: arrays of starts, ends, and the row each
+        came from. Arcs are split into as few equal chords as stay within tolerance of them, so small arcs get
+        enough to keep their shape, and big ones don't get more than they need. """
+        sweeps, radii = self.sweeps()
+        arcs = self.arcs()
+        count = (self.op == LINE).astype(np.int64)
+        # The widest angle a chord can span with its middle no further than tolerance from the arc
+        with np.errstate(divide = 'ignore'):
+            span = 2 * np.arccos(np.clip(1 - tolerance / radii[arcs], -1.0, 1.0))
+        count[arcs] = np.maximum(1, np.ceil(np.abs(sweeps[arcs]) / span))
+
+        row = np.repeat(np.arange(len(self)), count)
+        k = np.arange(len(row)) - np.repeat(np.cumsum(count) - count, count)
+        starts = self.starts()
+
+        def at(t):
+            # Points a fraction t of the way along each chord's row
+            pts = starts[row] + t[:,None] * (self.xy[row] - starts[row])
+            on_arc = arcs[row]
+            a = starts[row[on_arc]] - self.center[row[on_arc]]
+            angle = np.arctan2(a[:,1], a[:,0]) + t[on_arc] * sweeps[row[on_arc]]
+            pts[on_arc] = self.center[row[on_arc]] + radii[row[on_arc],None] * np.stack([np.cos(angle), np.sin(angle)], axis = 1)
+            return pts
+
+        n = count[row]
+        begin, end = at(k / n), at((k + 1) / n)
+        # Chords meet the rest of the path exactly, whatever rounding the trigonometry does
+        begin[k == 0] = starts[row[k == 0]]
+        end[k == n - 1] = self.xy[row[k == n - 1]]
+        return begin, end, row
+
+
+class Builder:
+    """ Builds a Toolpath up an operation (or a whole polyline) at a time """
+
+    def __init__(self):
+        self.blocks, self.rows, self.groups = [], [], []
+        self.count = 0
+        self.position = np.array([np.nan, np.nan])
+
+    def _row(self, op, xy, center = (np.nan, np.nan), feed = np.nan, dwell = np.nan):
+        self.rows.append((op, xy[0], xy[1], center[0], center[1], feed, dwell))
+        self.count += 1
+
+    def _flush(self):
+        # Single rows are kept as tuples until a block of rows arrives, then packed together
+        if self.rows:
+            rows = np.array(self.rows, dtype = float)
+            self.blocks.append((rows[:,0].astype(np.uint8), rows[:,1:3], rows[:,3:5], rows[:,5], rows[:,6]))
+            self.rows = []
+
+    def mark(self):
+        """ Start a new group """
+        self.groups.append(self.count)
+
+    def rapid(self, point, feed):
+        self.position = np.asarray(point, dtype = float)[0:2]
+        self._row(RAPID, self.position, feed = feed)
+
+    def line(self, point, feed):
+        self.position = np.asarray(point, dtype = float)[0:2]
+        self._row(LINE, self.position, feed = feed)
+
+    def lines(self, coords, feed):
+        """ Straight lines through every row of coords. feed may be an array, with a feed for each. """
+        coords = np.asarray(coords, dtype = float)[:,0:2]
+        n = len(coords)
+        if n == 0:
+            return
+        self._flush()
+        feed = np.broadcast_to(np.asarray(feed, dtype = float), (n,)).copy()
+        self.blocks.append((np.full(n, LINE, dtype = np.uint8), coords, np.full((n,2), np.nan), feed,
+                            np.full(n, np.nan)))
+        self.count += n
+        self.position = coords[-1]
+
+    def arc(self, arc, feed):
+        """ An Arc, from wherever the tool is (which should be its start) """
+        self.position = np.asarray(arc.end, dtype = float)[0:2]
+        self._row(ARC_CW if arc.clockwise else ARC_CCW, self.position, arc.center[0:2], feed)
+
+    def dwell(self, point, seconds = np.nan):
+        self.position = np.asarray(point, dtype = float)[0:2]
+        self._row(DWELL, self.position, dwell = seconds)
+
+    def lift(self):
+        self._row(LIFT, self.position)
+
+    def lower(self):
+        self._row(LOWER, self.position)
+
+    def draw(self, segment, feed, first = False):
+        """ Draw a segment, carrying on from the last one - unless it's the first in its group, which starts where
+        the tool already is. Polyline feeds may be arrays, with a feed for every vertex. """
+        n = 1 if first else 0
+        if isinstance(segment, burin.types.Polyline):
+            self.lines(segment.coords[n:], feed[n:] if isinstance(feed, np.ndarray) else feed)
+        elif isinstance(segment, burin.types.BSpline):
+            self.lines(segment.linearize_for_drawing()[n:], feed)
+        elif isinstance(segment, burin.types.Arc):
+            if not first:
+                self.line(segment.start, feed)
+            self.arc(segment, feed)
+        else:
+            self.dwell(segment.coords)
+
+    def stroke(self, segment, travel, plot, feeds = None):
+        """ The usual way to draw a group: rapid to its start, lower the tool, draw every segment, and lift the tool.
+        feeds, if given, has a feed (or None for plot) for every segment (see burin.feeds). """
+        self.rapid(segment[0].endpoints()[0], travel)
+        self.lower()
+        for i, seg in enumerate(segment):
+            feed = feeds[i] if feeds is not None else None
+            self.draw(seg, plot if feed is None else feed, i == 0)
+        self.lift()
+
+    def build(self):
+        self._flush()
+        if not self.blocks:
+            return Toolpath(np.empty(0, dtype = np.uint8), np.empty((0,2)), np.empty((0,2)), np.empty(0),
+                            np.empty(0), np.empty(0, dtype = np.int64))
+        op, xy, center, feed, dwell = (np.concatenate(x) for x in zip(*self.blocks))
+        return Toolpath(op, xy, center, feed, dwell, np.array(self.groups, dtype = np.int64))
+
+
+def compile_groups(groups, travel, plot, tolerance = None, planner = None):
+    """ A Toolpath drawing every group the usual way (see Builder.stroke), fitting arcs to within tolerance
+    (see burin.arcfit) if it's given, with feeds from planner (a burin.feeds.AdaptiveFeeds) if there is one """
+    builder = Builder()
+    for segment in groups:
+        if tolerance:
+            segment = arcfit.fit_group(segment, tolerance)
+        builder.mark()
+        builder.stroke(segment, travel, plot, planner.group(segment) if planner is not None else None)
+    return builder.build()
+
+def batched(groups, size = BATCH):
+    """ Lists of up to size groups at a time from an iterator of them """
+    groups = iter(groups)
+    while True:
+        batch = list(itertools.islice(groups, size))
+        if not batch:
+            return
+        yield batch
+
+def compile_batches(groups, travel, plot, tolerance = None, planner = None, size = BATCH):
+    """ compile_groups for a stream of groups, a Toolpath for every batch of them """
+    for batch in batched(groups, size):
+        yield compile_groups(batch, travel, plot, tolerance, planner)
@@ -53,20 +53,91 @@ def reverse_knot_vector(knots):
 
 
 def polyline_mean(pts):
-    length = 0
-    acc = np.zeros(2)
-    n,_ = pts.shape
-    for i in range(n -1):
-        a,b = pts[i + 1], pts[i]
-        delta = a - b
-        mean = 0.5 * (a + b)
-        l = np.sqrt(delta.dot(delta))
-        length += l
-        acc += l * mean
+    delta = pts[1:] - pts[:-1]
+    lengths = np.sqrt(np.sum(delta * delta, axis = 1))
+    length = lengths.sum()
+    acc = lengths @ (0.5 * (pts[1:] + pts[:-1]))
         
     return length, acc / length
 
 
+def evaluate_bspline(degree, control, knots, params):
+    """ De Boor's algorithm, run over a whole array of parameters at once """
+    n,_ = control.shape
+    span = np.clip(np.searchsorted(knots, params, side = 'right') - 1, degree, n - 1)
+    # m x (degree + 1) x dim - the control points influencing each parameter
+    d = control[span[:,None] + np.arange(0 - degree, 1)[None,:]]
+    
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            lo = knots[span + j - degree]
+            hi = knots[span + j + 1 - r]
+            denom = hi - lo
+            alpha = np.divide(params - lo, denom, out = np.zeros_like(params), where = denom != 0)
+            d[:,j] = (1 - alpha)[:,None] * d[:,j - 1] + alpha[:,None] * d[:,j]
+            
+    return d[:,degree]
+
+
+def pack_segments(segments):
+    """ Pack the coordinates of a list of Points, Polylines and Arcs into one n x 2 array. Returns a
+    (class, clockwise) pair for every segment, the array, and the offsets of each segment in it """
+    kinds, blocks, offsets = [], [], [0]
+    for s in segments:
+        if isinstance(s, Arc):
+            kinds.append((Arc, s.clockwise))
+            pts = np.array([s.start, s.end, s.center])
+        elif isinstance(s, Point):
+            kinds.append((Point, False))
+            pts = s.coords.reshape((1,2))
+        else:
+            kinds.append((Polyline, False))
+            pts = s.coords[:,0:2]
+        blocks.append(pts)
+        offsets.append(offsets[-1] + pts.shape[0])
+
+    points = np.vstack(blocks) if blocks else np.empty((0,2))
+    return kinds, points, np.array(offsets)
+
+def unpack_segments(kinds, points, offsets, flip = False):
+    """ Inverse of pack_segments - if flip is set, all of the arcs change direction """
+    acc = []
+    for j, (kind, clockwise) in enumerate(kinds):
+        a, b = offsets[j], offsets[j + 1]
+        if kind is Arc:
+            acc.append(Arc(points[a], points[a + 1], points[a + 2], clockwise != flip))
+        elif kind is Point:
+            acc.append(Point(points[a]))
+        else:
+            acc.append(Polyline(points[a:b]))
+    return acc
+    
+def transform_instances(segments, matrices, tolerance):
+    """ Make a transformed copy of a list of segments for every 2x3 matrix in a stack of them. All
+    of the coordinates are packed into one array and transformed at once, and the results are
+    instance-major (every segment of the first instance, then the second, ...) """
+
+    k = len(matrices)
+    if k == 0 or not segments:
+        return []
+
+    linear = matrices[:,:,0:2]
+    # Arcs only stay arcs under transforms that preserve circles
+    gram = linear @ linear.transpose(0,2,1)
+    if not (np.allclose(gram[:,0,1], 0) and np.allclose(gram[:,0,0], gram[:,1,1])):
+        segments = [s.to_polyline(tolerance) if isinstance(s, Arc) else s for s in segments]
+
+    kinds, points, offsets = pack_segments(segments)
+    # k x n x 2 - every point, under every transform
+    transformed = np.einsum('kij,nj->kni', linear, points) + matrices[:,None,:,2]
+    flips = (linear[:,0,0] * linear[:,1,1] - linear[:,0,1] * linear[:,1,0]) < 0
+
+    acc = []
+    for i in range(k):
+        acc += unpack_segments(kinds, transformed[i], offsets, flips[i])
+    return acc
+
+
 class Segment:
 
     def __init__(self):
@@ -188,37 +259,48 @@ class Polyline (Segment):
         yield end
 
 class BSpline(Segment):
-    """ A thin wrapper over NURBS-python's BSpline curve """
+    """ A non-rational B-spline curve, kept as NumPy arrays of control points and knots """
 
-    def __init__(self, bspline, tolerance):
+    def __init__(self, degree, pts, knots, tolerance):
         
-        self.crv = bspline
-        self.pts = np.array(self.crv.ctrlpts)[:,0:2]
+        self.degree = degree
+        self.pts = np.ascontiguousarray(pts[:,0:2], dtype = float)
+        self.knots = np.array(knots, dtype = float)
         self.tolerance = tolerance
+
+    def domain(self):
+        n,_ = self.pts.shape
+        return self.knots[self.degree], self.knots[n]
+
+    def evaluate(self, params):
+        return evaluate_bspline(self.degree, self.pts, self.knots, np.asarray(params, dtype = float))
+    
+    def sample(self, count):
+        lo, hi = self.domain()
+        return self.evaluate(np.linspace(lo, hi, count))
         
     def transform(self, matrix):
         """ Transform this object with a 2x3 matrix """
         n,_ = self.pts.shape
         self.pts = np.hstack([self.pts, np.ones((n,1))]) @ matrix.T
-        self.crv.ctrpts = self.pts.tolist()
     
     def flip(self):
         # Simple enough!
-        reverse_knot_vector(self.crv.knotvector)
-        self.crv.ctrlpts.reverse()
-        self.pts = np.flip(self.pts, axis =  0)
+        self.knots = self.knots.copy()
+        reverse_knot_vector(self.knots)
+        self.pts = np.ascontiguousarray(np.flip(self.pts, axis =  0))
     
     def entrance_vector(self, previous, exit_vector = False):
-        pts = self.crv.ctrlpts
+        pts = self.pts
         a,b = (pts[-1], pts[-2]) if exit_vector else (pts[1], pts[0])
-        delta = np.array([a[0] - b[0], a[1] - b[1]])
+        delta = a - b
         delta /= np.sqrt(delta.dot(delta))
         return delta
         
     
     def endpoints(self):
-        start,end = self.crv.evaluate_list([0,1])
-        return np.array(start[0:2]), np.array(end[0:2])
+        start,end = self.evaluate(self.domain())
+        return start, end
     
     def can_join(self, other):
         return True
@@ -230,12 +312,11 @@ class BSpline(Segment):
 
     def mean(self):
         # Compute this a bit more accurately - but not neccesarily at the final resolution
-        return polyline_mean(np.array(self.crv.evalpts))
+        return polyline_mean(self.linearize_for_drawing())
 
     def linearize_for_drawing(self):
 
-        self.crv.sample_size = max(2, math.ceil(self.length_hash() / self.tolerance))
-        return np.array(self.crv.evalpts)[:,0:2]
+        return self.sample(max(2, math.ceil(self.length_hash() / self.tolerance)))
     
         
 class Arc (Segment):
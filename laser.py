@@ -1,9 +1,14 @@
 import burin.process
+import burin.output
 import burin.types
+import burin.tiling as tiling
+import burin.galvo
 import numpy as np
+import json
 import os
 import math
 import copy
+import itertools
 from pewpew.definitions import Segment
 
 from pewpew.job_file import write_file
@@ -20,10 +25,49 @@ class DefaultLaser(burin.process.BaseProcess):
                                    passes = 1,
                                    point_time = 0.005)
         
+    def output_file(self, directory, unit):
+        """ Units too big for the field become a laser job per tile, listed (in the order to run them, with how
+        far to move the stage for each) in this file """
+        return os.path.join(directory, unit + ".tiles.json")
+
+    def job_file(self, directory, unit, tile, count):
+        """ The laser job for a tile - just the unit's name, if it fits in one field """
+        return os.path.join(directory, unit + (f".tile-{tile.index}" if count > 1 else "") + ".laser")
+        
     def write_file(self, directory, unit, events):
-        filepath = os.path.join(directory, unit + ".laser")
-        write_file(filepath, list(events), name = unit, preview = unit == 'Preview')
+        # Each tile's job is written as soon as its events are all in, so only one tile's are held at a time
+        jobs = []
+        for tile, contents in itertools.chain(tiling.by_tile(events), [(None, [])]):
+            if tile is None:
+                if jobs:
+                    break
+                # Nothing to mark still makes an (empty) job
+                tile = tiling.Tile(0, 0, 0, (0.0, 0.0))
+            path = self.job_file(directory, unit, tile, tile.count)
+            name = unit if tile.count == 1 else f"{unit} (tile {tile.index})"
+            with burin.output.atomic(path) as filepath:
+                # pewpew's writer takes a whole job (it's a list it can count and preview), so this is where the
+                # tile's events have to be gathered
+                write_file(filepath, list(contents), name = name, preview = unit == 'Preview')
+            jobs.append(dict(tile.record(), file = os.path.basename(path)))
+
+        blob = {'field_size' : machine_parameters.field_size, 'jobs' : jobs}
+        cycles = [j['cycle'] for j in jobs if 'cycle' in j]
+        if cycles:
+            blob['cycle'] = {k : sum(c[k] for c in cycles) for k in ('before', 'after')}
+
+        # The list goes last, so it's only there if every job is
+        with burin.output.atomic(self.output_file(directory, unit)) as tmp, open(tmp, 'w') as f:
+            json.dump(blob, f, indent = 1)
     
+    def summary(self, directory, unit):
+        """ How long the galvo ordering says the unit takes to mark, against the nearest-first order """
+        with open(self.output_file(directory, unit)) as f:
+            cycle = json.load(f).get('cycle')
+        if cycle is None:
+            return None
+        return f"Unit {unit}: mark and jump cycle {cycle['after']:.2f}s, from {cycle['before']:.2f}s nearest-first"
+
     def layers_to_units(self, layers):
 
         units = []
@@ -33,14 +77,32 @@ class DefaultLaser(burin.process.BaseProcess):
 
         return units
 
+    def unit_dependencies(self, unit_name):
+        # Every layer is its own job, with nothing shared between them
+        return []
+
     def geometry_parameters(self, unit_name):
         """ How should we process each layer - specifies a line segment length for conversion from
         dxf geometry, and all of the parameters to the linker/optimizer/cleaner. """
-        return {'link': True, 'reverse' : True, 'deduplicate' : True, 'merge' : 0.01}
+        return {'link': True, 'reverse' : True, 'deduplicate' : True, 'merge' : 0.01, 'tile' : self.tile_parameters(unit_name),
+                'order' : 'galvo', 'timing' : self.galvo_timing(unit_name)}
+
+    def galvo_timing(self, unit_name):
+        """ What marks and jumps cost, for ordering paths (see burin.galvo) - marking at this process's speed """
+        return dict(burin.galvo.TIMING, mark_speed = type(self).PARAMETERS.speed)
+
+    def tile_parameters(self, unit_name):
+        """ How to split geometry bigger than the field into tiles (see burin.tiling) - the overlap between fields
+        is in mm, and arcs cut at the edges are flattened as finely as they would be for marking """
+        size = machine_parameters.field_size
+        return {'size' : size, 'overlap' : 1.0, 'tolerance' : machine_parameters.chord_error * size}
     
     def generate_code(self, unit_name, segments):
         parameters = type(self).PARAMETERS if (unit_name[0] != 'Preview') else cg.PassParameters(preview = True, speed = 200.0)
-        yield from cg.generate_unit(parameters, machine_parameters, segments)
+        for tile, groups in tiling.by_tile(segments):
+            if tile is not None:
+                yield tile
+            yield from cg.generate_unit(parameters, machine_parameters, groups)
 
 
 class StainlessStencil(DefaultLaser):
@@ -1,6 +1,7 @@
 import burin.process
 import burin.types
 import burin.codegen
+import burin.toolpath
 import numpy as np
 
 
@@ -18,6 +19,7 @@ class Pencil(burin.process.BaseProcess):
         first, last = self.subunit_position(unit_name)
 
         cg = burin.codegen.GCodeGen()
+        cg.modal = self.output_parameters(unit_name)['modal']
 
         cg.heights['v_down'] = 5.25
 
@@ -27,8 +29,9 @@ class Pencil(burin.process.BaseProcess):
             yield from cg.prompt_pen_change()
             yield from cg.go_to_travel()
 
-        for s in segments:
-            yield from cg.generate_segment(s)
+        for path in cg.compile(segments):
+            yield from cg.translate(path)
+        yield from cg.report_feeds()
         
         if last:
             yield from cg.finish_plot()
@@ -48,6 +51,7 @@ class Watercolor(burin.process.BaseProcess):
         first, last = self.subunit_position(unit_name)
 
         cg = burin.codegen.GCodeGen()
+        cg.modal = self.output_parameters(unit_name)['modal']
         
         cg.heights['v_travel'] = 2.0
     
@@ -57,17 +61,20 @@ class Watercolor(burin.process.BaseProcess):
             yield from cg.start_plot()
             yield from cg.go_to_travel()
 
-        for s in segments:
-            
-            yield f"G1 X{x} Y{y} F{cg.speeds['travel']}"
-            yield f"G0 V{cg.heights['v_down']} F{cg.speeds['v']}"
-            yield f"G1 X{x+10} Y{y} F{cg.speeds['travel']}"
-            yield f"G0 V{cg.heights['v_travel']} F{cg.speeds['v']}"
-            
-            
-            yield from cg.generate_segment(s)
+        for batch in burin.toolpath.batched(segments):
+            builder = burin.toolpath.Builder()
+            for s in batch:
+                # Dip the brush in the paint before every group
+                builder.mark()
+                builder.line((x, y), cg.speeds['travel'])
+                builder.lower()
+                builder.line((x + 10, y), cg.speeds['travel'])
+                builder.lift()
 
+                cg.stroke(builder, s)
+            yield from cg.translate(builder.build())
 
+        yield from cg.report_feeds()
               
         if last:
             yield from cg.finish_plot()
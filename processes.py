@@ -1,5 +1,9 @@
 import burin.process
 import burin.types
+import burin.gcode as gcode
+import burin.arcfit as arcfit
+import burin.toolpath as toolpath
+import burin.feeds as feeds
 import numpy as np
 import math
 
@@ -13,10 +17,28 @@ class SimpleProcess(burin.process.BaseProcess):
         return geo
     
     def speeds(self,unit_name):
-        return {'travel' : 10000, 'plot' : 2000, 'clearance' : 100}
+        # Plot moves can speed up from plot towards plot_max wherever the geometry allows (see burin.feeds) - set
+        # plot_max in a subclass to turn that on, to a speed the machine is known to manage
+        return {'travel' : 10000, 'plot' : 2000, 'plot_max' : None, 'clearance' : 100}
     
     def heights(self,unit_name):
         return {'clearance' : {'Z' : 15}, 'travel' : {'V' : 4, 'Z' : 10}, 'plot' : {'V' : 5.5}}
+
+    def precision(self, unit_name):
+        """ Decimal places for X and Y coordinates """
+        return gcode.DEFAULT_PRECISION
+
+    def arc_tolerance(self, unit_name):
+        """ How far arcs fitted to runs of short lines may stray from them (see burin.arcfit), or None to not fit any
+        - set it in a subclass to turn fitting on """
+        return None
+
+    def feed_planner(self, unit_name):
+        """ Adaptive plotting feeds between the plot and plot_max speeds, or None if there's no plot_max """
+        speeds = self.speeds(unit_name)
+        if speeds.get('plot_max') is None:
+            return None
+        return feeds.AdaptiveFeeds(speeds['plot'], speeds['plot_max'])
     
     def prelude(self,unit_name, starting_position):
         speeds = self.speeds(unit_name)
@@ -26,10 +48,14 @@ class SimpleProcess(burin.process.BaseProcess):
         yield f"G0 {axes_dict(heights['clearance'])} F{speeds['clearance']}"
         yield "G28 V0"
         yield "T3"
-        yield f"G0 X{starting_position[0]} Y{starting_position[1]} F{speeds['travel']}"
+        yield gcode.move("G0", starting_position, speeds['travel'], self.precision(unit_name))
         yield f"G0 {axes_dict(heights['travel'])} F{speeds['clearance']}"
         yield "; Begin plotting!"
     
+    def resume_preamble(self, unit_name, state):
+        speeds = self.speeds(unit_name)
+        return gcode.reentry(state, self.heights(unit_name)['clearance'], speeds['travel'], speeds['clearance'])
+
     def postlude(self,unit_name):
         speeds = self.speeds(unit_name)
         heights = self.heights(unit_name)
@@ -43,34 +69,19 @@ class SimpleProcess(burin.process.BaseProcess):
         
         speeds = self.speeds(unit_name)
         up_height, down_height = self.heights(unit_name)['travel']['V'], self.heights(unit_name)['plot']['V']
-        plot, travel = speeds['plot'], speeds['travel']
+        planner = self.feed_planner(unit_name)
+        modal = self.output_parameters(unit_name)['modal']
 
-        if len(segments) == 0:
+        start, segments = burin.process.peek(segments)
+        if start is None:
             return
 
-        yield from self.prelude(unit_name, segments[0][0].endpoints()[0])
-        for segment in segments:
-            start = segment[0].endpoints()[0]
-            yield f"G0 X{start[0]} Y{start[1]} F{travel}"
-            yield f"G0 V{down_height} F4000"
-
-            for i, seg in enumerate(segment):
-                if isinstance(seg, burin.types.Polyline):
-                    n = 1 if i == 0 else 0
-                    for x,y in seg.coords[n:]:
-                        yield f"G1 X{x} Y{y} F{plot}"
-                
-                elif isinstance(seg, burin.types.Arc):
-                    start, end = seg.endpoints()
-                    I,J = seg.center - start
-                    if i != 0:
-                        yield f"G1 X{start[0]} Y{start[1]} F{plot}"
-                    yield f"G{2 if seg.clockwise else 3} X{end[0]} Y{end[1]} I{I} J{J} F{plot}"
-                    
-                else:
-                    yield ";Point!"
-            yield f"G0 V{up_height} F4000"
-        
+        yield from self.prelude(unit_name, start[0].endpoints()[0][0:2])
+        for path in toolpath.compile_batches(segments, speeds['travel'], speeds['plot'], self.arc_tolerance(unit_name), planner):
+            yield from gcode.translate(path, f"G0 V{down_height} F4000", f"G0 V{up_height} F4000", self.precision(unit_name),
+                                       modal = modal)
+        if planner is not None:
+            yield from planner.report()
         yield from self.postlude(unit_name)
 
 
@@ -111,6 +122,11 @@ class Multilayer(SimpleProcess):
 
         return acc
 
+    def unit_dependencies(self, unit_name):
+        # Everything is aligned relative to the fiducials, which are plotted with the first unit
+        first = self.units[0]['name']
+        return [] if unit_name == first else [first]
+
     def draw_fiducial_at(self, origin, scale = 0.5):
         i,j = np.array([1,0]), np.array([0,1])
 
@@ -167,58 +183,51 @@ class Multilayer(SimpleProcess):
         speeds = self.speeds(unit_name)
         up_height, down_height = self.heights(unit_name)['travel']['V'], self.heights(unit_name)['plot']['V']
         plot, travel = speeds['plot'], speeds['travel']
-
-        if len(segments) == 0:
-            return
+        tolerance = self.arc_tolerance(unit_name)
 
         first, last = self.subunit_position(unit_name)
+        planner = self.feed_planner(unit_name)
+        modal = self.output_parameters(unit_name)['modal']
+
+        start, segments = burin.process.peek(segments)
+        if start is None:
+            return
 
         if first:
-            yield from self.prelude(unit_name, segments[0][0].endpoints()[0])
+            yield from self.prelude(unit_name, start[0].endpoints()[0][0:2])
       
         yield f"; Starting subunit {unit_name[1]}"
-
-
-        for segment in segments:
-
-            start = segment[0].endpoints()[0]
-            yield f"G0 X{start[0]} Y{start[1]} F{travel}"
-
-            for i, seg in enumerate(segment):
-                if isinstance(seg, burin.types.Polyline):
-                    if 'backlash' in seg.__dict__ and seg.backlash:
-                        yield f"G0 V{up_height} F4000" # Regardless of previous state...
-                        first, second = seg.coords[0], seg.coords[1]
-                        yield f"G1 X{first[0]} Y{first[1]} F{travel}"
-                        yield f"G1 X{second[0]} Y{second[1]} F{travel}"
-                        yield f"G0 V{down_height} F4000"
-                        for x,y in seg.coords[2:]:
-                            yield f"G1 X{x} Y{y} F{plot}"
+        for batch in toolpath.batched(segments):
+            builder = toolpath.Builder()
+            for segment in batch:
+                if tolerance:
+                    segment = arcfit.fit_group(segment, tolerance)
+
+                builder.mark()
+                builder.rapid(segment[0].endpoints()[0], travel)
+
+                for i, seg in enumerate(segment):
+                    # The pen comes up after every segment, so each one starts and ends at the slowest feed
+                    feed = planner.group([seg])[0] if planner is not None else None
+                    if isinstance(seg, burin.types.Polyline) and 'backlash' in seg.__dict__ and seg.backlash:
+                        builder.lift() # Regardless of previous state...
+                        builder.lines(seg.coords[0:2], travel)
+                        builder.lower()
+                        builder.lines(seg.coords[2:], plot)
+                    elif isinstance(seg, burin.types.Point):
+                        builder.dwell(seg.coords)
+                        builder.lower()
                     else:
                         if i == 0:
-                            yield f"G0 V{down_height} F4000"
-                        n = 1 if i == 0 else 0
-                        for x,y in seg.coords[n:]:
-                            yield f"G1 X{x} Y{y} F{plot}"
-            
-                elif isinstance(seg, burin.types.Arc):
-                    start, end = seg.endpoints()
-                    I,J = seg.center - start
-                    if i != 0:
-                        yield f"G1 X{start[0]} Y{start[1]} F{plot}"
-                    else:
-                        yield f"G0 V{down_height} F4000"
-                    yield f"G{2 if seg.clockwise else 3} X{end[0]} Y{end[1]} I{I} J{J} F{plot}"
-                    
-                else:
-                    yield ";Point!"
-                    yield f"G0 V{down_height} F4000"
-                      
-
-                yield f"G0 V{up_height} F4000"
-      
-        
+                            builder.lower()
+                        builder.draw(seg, plot if feed is None else feed, i == 0)
+
+                    builder.lift()
+
+            yield from gcode.translate(builder.build(), f"G0 V{down_height} F4000", f"G0 V{up_height} F4000",
+                                       self.precision(unit_name), modal = modal)
         
+        if planner is not None:
+            yield from planner.report()
         if last:
             yield from self.postlude(unit_name)
-        
@@ -1,83 +1,51 @@
 #!/usr/bin/env python3
 import click
+import contextlib
+import functools
+import itertools
 import json
 import os
-import shutil
+import time
 
-import burin.path as pathcleaner
-import burin.dxfloader as dxfloader
-import importlib
+# Geometry libraries (ezdxf, scipy, numpy) are slow to import, so commands import what they
+# need when they run - commands like 'list' never pay for them. Everything past the command line
+# lives in burin.pipeline.
 
-def get_blob(directory):
-    blob = os.path.join(directory,"state.json")
-    if not os.path.exists(blob):
-        print(f"Unable to find workflow state {blob}")
-        exit(-1)
-    with open(blob,"r") as f:
-        return json.load(f)
-    
-def save_blob(directory, blob):
-    # Make sure that the output directory is actually a thing
-    if not os.path.exists(directory):
-        os.mkdir(directory)
-    elif not os.path.isdir(directory):
-        print(f"Output directory '{directory}' already exists, but is not a directory")
-        exit(-1)
-        
-    blob_path = os.path.join(directory,"state.json")
-    with open(blob_path,'w') as f:
-        json.dump(blob, f)
-        
-    return blob_path
-
-def load_process(process):
-    splat = process.split('.')
-    module,clss = '.'.join(splat[:-1]), splat[-1]
+def ask(unit, parameter):
+    return input(f"Parameter {parameter} for unit {unit}: ").strip()
 
+@contextlib.contextmanager
+def reporting_errors():
+    import burin.pipeline
     try:
-        mod = importlib.import_module(module)
-    except:
-        print(f"Unable to find module {module}")
+        yield
+    except burin.pipeline.PipelineError as e:
+        print(e)
         exit(-1)
 
-    if clss not in mod.__dict__:
-        print(f"Unable to find process {clss} in module {module}")
-        exit(-1)
-        
-    return mod.__dict__[clss]()
-
-    
-def check_parameters(blob, unit,prompt = True, reset = False):
-
-    stages, parameters, units = blob['stage'], blob['parameters'], blob['units']
-    ok,updated = True,False
-
-    # If we're resetting parameters for this layer, purge the old ones
-    if reset and (unit in parameters):
-        parameters[unit] = {}
-        updated = True
-    # Go through all of the previous units (+ the current) and make
-    # sure all of the required parameters are there
-    for i in range(0, 1 + stages[unit]):
-        u = units[i]
-        name = u['name']
-        if name not in parameters:
-            parameters[name] = {}
-        scope = parameters[name]
-        for p in u['parameters']:
-            if p not in scope:
-                if prompt:
-                    scope[p] = input(f"Parameter {p} for unit {name}: ").strip()
-                    updated = True
-                else:
-                    ok = False
-                    
-    return ok, updated
+def flatten_pool(jobs):
+    """ A process pool for flattening geometry, or None if we're doing it serially """
+    if jobs < 2:
+        return contextlib.nullcontext()
+    import concurrent.futures
+    return concurrent.futures.ProcessPoolExecutor(jobs)
+
+def make_profiler(enabled, cprofile):
+    import burin.profile
+    return burin.profile.Profiler(cprofile) if enabled else burin.profile.NullProfiler()
+
+def make_render(pool, flatten_jobs):
+    import burin.dxfloader as dxfloader
+    import burin.flatten as flatten
+
+    if pool is None:
+        return dxfloader.render_entities
+    return functools.partial(flatten.render_parallel, executor = pool, workers = flatten_jobs)
+
 
-        
 @click.group()
 @click.pass_context
-def main(ctx):    
+def main(ctx):
     pass
 
 @main.command()
@@ -86,37 +54,16 @@ def main(ctx):
 @click.argument('directory')
 @click.pass_context
 def start(ctx, filepath, process, directory):
+    from burin.pipeline import Pipeline
+
+    with reporting_errors():
+        pipeline = Pipeline.start(filepath, process, directory)
 
-    if not os.path.exists(filepath):
-        print(f"Input file {filepath} doesn't exist")
-         
-    
-    proc = load_process(process)
-
-    # Establish that the output directory exists by saving a blank conf
-    save_blob(directory, {})
-
-    shutil.copy(filepath, os.path.join(directory, 'input.dxf'))
-    layers = dxfloader.load_layers(filepath)
-    units = proc.layers_to_units(layers)
-    # Make sure we didn't declare any units twice...
-    stage, names = {}, []
-    for i,u in enumerate(units):
-        name = u['name']
-        names.append(name)
-        if name in stage:
-            print(f"Invalid process - unit {name} declared twice")
-            exit(-1)
-        stage[name] = i
-    
     print("Found workflow units:")
-    for n in names:
+    for n in pipeline.units():
         print(f"    {n}")
-    # Build a json blob containing the state of the current execution flow...
-    blob = {'process' : process, 'units' : units, 'parameters' : {}, 'stage': stage}
-    #... and put it in the output directory
-    print(f"Wrote workflow state to {save_blob(directory, blob)}")
-    
+    print(f"Wrote workflow state to {os.path.join(directory, 'state.json')}")
+
 @main.command()
 @click.argument('directory')
 @click.pass_context
@@ -124,94 +71,277 @@ def list(ctx, directory):
     blob = os.path.join(directory,"state.json")
     if not os.path.exists(blob):
         print(f"Unable to find workflow state {blob}")
-    
+
     with open(blob,"r") as f:
         blob = json.load(f)
-        
+
     print("Workflow units:")
     for u in blob['units']:
         print(f"    {u['name']}")
- 
+
 
 @main.command()
 @click.argument('unit')
 @click.argument('directory')
+@click.option('--flatten-jobs', default = 0, help = 'Flatten geometry in a pool of this many processes')
+@click.option('--force', is_flag = True, help = 'Regenerate output even if nothing has changed')
+@click.option('--profile', is_flag = True, help = 'Record time, memory, and item counts for every stage')
+@click.option('--cprofile', is_flag = True, help = 'With --profile, also dump a cProfile of the slowest stage')
 @click.pass_context
-def unit(ctx, unit, directory):
-    run_unit(unit, directory)
+def unit(ctx, unit, directory, flatten_jobs, force, profile, cprofile):
+    from burin.pipeline import Pipeline
 
-def run_unit(unit, directory):
-    
-    state = get_blob(directory)
+    with reporting_errors(), flatten_pool(flatten_jobs) as pool:
+        pipeline = Pipeline.open(directory)
+        run_unit(pipeline, unit, make_render(pool, flatten_jobs), force, make_profiler(profile, cprofile))
 
-    if unit not in state['stage']:
-        print(f"Can't find unit {unit}")
-        exit(-1)
+def show_summary(pipeline, unit):
+    summary = pipeline.summary(unit)
+    if summary is not None:
+        print(summary)
+
+def run_unit(pipeline, unit, render, force = False, profiler = None):
+    """ Run one unit of an open pipeline, loading the dxf if it hasn't been yet """
 
-    # do magic to load the process def from the string in the json...
-    proc = load_process(state['process'])
-    
-        
-    unit_record = state['units'][state['stage'][unit]]
-    
     # should have optional flags here - reset current parameters, and prompt or just fail
-    ok, new = check_parameters(state, unit)
+    pipeline.parameters(unit, prompt = ask)
+
+    profiler = profiler if profiler is not None else make_profiler(False, False)
+    if profiler.enabled:
+        profiler.start()
+
+    if pipeline.dxf_entities is None:
+        with profiler.stage((unit, None), 'parse') as record:
+            pipeline.load()
+            record['items'] = sum(len(x) for x in pipeline.dxf_entities.values())
+
+    if not pipeline.run(unit, force, render, profiler):
+        print(f"Unit {unit} is up to date")
+    else:
+        show_summary(pipeline, unit)
+
+    if profiler.enabled:
+        profiler.stop()
+        print(profiler.table())
+        print(f"Wrote profile to {', '.join(profiler.write(pipeline.directory, unit))}")
+
+
+@main.command()
+@click.argument('directory')
+@click.option('--flatten-jobs', default = 0, help = 'Flatten geometry in a pool of this many processes')
+@click.option('--jobs', default = 1, help = 'Run independent units and subunits in a pool of this many processes')
+@click.option('--force', is_flag = True, help = 'Regenerate output even if nothing has changed')
+@click.option('--profile', is_flag = True, help = 'Record time, memory, and item counts for every stage')
+@click.option('--cprofile', is_flag = True, help = 'With --profile, also dump a cProfile of the slowest stage')
+@click.pass_context
+def all(ctx, directory, flatten_jobs, jobs, force, profile, cprofile):
+    from burin.pipeline import Pipeline
+
+    with reporting_errors():
+        pipeline = Pipeline.open(directory)
+
+        if jobs > 1 and profile:
+            print("Profiling runs units one at a time - ignoring --jobs")
+        elif jobs > 1:
+            # Workers can't prompt for anything, so collect every unit's parameters up front
+            pipeline.parameters(prompt = ask)
+            def finished(unit):
+                print(f"Finished {unit}")
+                show_summary(pipeline, unit)
+            skipped = pipeline.run_parallel(jobs, force, finished)
+            for u in skipped:
+                print(f"Unit {u} is up to date")
+            return
+
+        with flatten_pool(flatten_jobs) as pool:
+            render = make_render(pool, flatten_jobs)
+            for stage in pipeline.units():
+                print(f"Processing {stage}")
+                run_unit(pipeline, stage, render, force, make_profiler(profile, cprofile))
+
 
-    if new:
-        save_blob(directory, state)
-    if not ok:
-        print(f"Unspecified parameters for unit {unit}")
+@main.command()
+@click.argument('process')
+@click.argument('outdir')
+@click.argument('files', nargs = -1, required = True)
+@click.option('--parameters', 'parameter_file', default = None, help = 'JSON file of parameters, by unit name ("*" for every unit)')
+@click.option('--jobs', default = None, type = int, help = 'How many files to process at once (defaults to the number of CPUs)')
+@click.option('--force', is_flag = True, help = 'Regenerate output even if nothing has changed')
+@click.pass_context
+def batch(ctx, process, outdir, files, parameter_file, jobs, force):
+    """ Run start + all for many dxf files, each in its own directory under OUTDIR """
+    import burin.batch
+
+    parameters = {}
+    if parameter_file is not None:
+        with open(parameter_file) as f:
+            parameters = json.load(f)
+
+    def finished(record):
+        print(f"{'Finished' if record['ok'] else 'FAILED'} {record['file']} ({record['seconds']:.2f}s)")
+
+    records = burin.batch.run_batch(process, outdir, files, parameters, jobs, force, finished)
+    report = os.path.join(outdir, 'batch.json')
+    with open(report, 'w') as f:
+        json.dump(records, f, indent = 1)
+
+    print(burin.batch.summary(records))
+    print(f"Wrote report to {report}")
+    if any(not r['ok'] for r in records):
         exit(-1)
 
-    loading_params = proc.conversion_parameters()
 
-    # Load all of the dxf entities we'll need for this unit
-    layers = set().union(*(set(x) for _,x in unit_record['subunits']))
-    dxf_entities, errors = dxfloader.load_entities(os.path.join(directory, 'input.dxf'),
-                                                   layers, arcs = loading_params['arcs'])
-    if errors:
-        print("Error loading dxf:")
-        for x in errors:
-            print("    ", x[0])
+@main.command()
+@click.argument('unit')
+@click.argument('directory')
+@click.option('--connect', default = None, help = "Controller address (host:port, or a socket path) speaking plain G-code with 'ok' replies - otherwise DSF")
+@click.option('--window', default = 16, help = 'How many lines can be waiting for acknowledgement at once')
+@click.pass_context
+def send(ctx, unit, directory, connect, window):
+    """ Stream a unit's G-code straight to the controller as it's generated """
+    from burin.pipeline import Pipeline
+    import burin.gcode
+    import burin.stream
+
+    with reporting_errors():
+        pipeline = Pipeline.open(directory)
+        pipeline.parameters(unit, prompt = ask)
+        lines = burin.gcode.unmarked(pipeline.generate(unit))
+
+        start = time.perf_counter()
+        try:
+            if connect is None:
+                sent = burin.stream.send_to_machine(lines, window)
+            else:
+                sent = burin.stream.send(connect, lines, window)
+        except (burin.stream.StreamError, OSError) as e:
+            print(f"Error sending {unit}: {e}")
+            exit(-1)
+    print(f"Sent {sent} lines in {time.perf_counter() - start:.2f}s")
+
+@main.command()
+@click.argument('unit')
+@click.argument('directory')
+@click.option('--from', 'group', required = True, type = int, help = 'Group to start from (counting from 0)')
+@click.option('--output', 'path', default = None, help = 'Where to write the resumed G-code (defaults to UNIT.from-N.gcode in DIRECTORY)')
+@click.pass_context
+def resume(ctx, unit, directory, group, path):
+    """ Pick a unit's output back up part way through, after an interruption, without regenerating it """
+    from burin.pipeline import Pipeline
+    import burin.output
+
+    with reporting_errors():
+        pipeline = Pipeline.open(directory)
+    process = pipeline.process
+    source, index = process.output_file(directory, unit), process.index_file(directory, unit)
+    if not os.path.exists(index):
+        print(f"Unable to find the group index {index} - run the unit again to make one")
+        exit(-1)
+
+    with open(index) as f:
+        groups = json.load(f)['groups']
+    if not 0 <= group < len(groups):
+        print(f"Unit {unit} has groups 0 to {len(groups) - 1}")
         exit(-1)
-    # Give the newly-reconstituted process a little context as to what's happening
-    proc.parameters = state['parameters']
-    proc.units = state['units']
-    proc.stage = state['stage']
 
+    entry = groups[group]
+    remainder = burin.output.read_bytes(source)[entry['offset']:].decode()
+    path = path if path is not None else os.path.join(directory, f"{unit}.from-{group}.gcode")
+    lines = itertools.chain(process.resume_preamble(unit, entry['state']), remainder.splitlines())
+    burin.output.write_lines(path, lines)
+    print(f"Wrote {path}, resuming at line {entry['line'] + 1} of {source}")
 
+@main.command('fake-controller')
+@click.argument('address')
+@click.option('--delay', default = 0.0, help = 'Seconds to take over every line')
+@click.option('--log', 'log_file', default = None, help = 'Append every line received to this file')
+@click.pass_context
+def fake_controller(ctx, address, delay, log_file):
+    """ Pretend to be a controller at ADDRESS (host:port, or a socket path), for testing send """
+    import asyncio
+    import burin.stream
+
+    with (open(log_file, 'a') if log_file else contextlib.nullcontext()) as log:
+        print(f"Listening on {address}")
+        try:
+            asyncio.run(burin.stream.FakeController(address, delay, log).serve_forever())
+        except KeyboardInterrupt:
+            pass
 
-    def seg_gen():
 
-        
-        for subname, layers in unit_record['subunits']:
-            full_name = unit, subname
-            gp = proc.geometry_parameters(full_name) 
-            geo = []
-            for layer in layers:
+@main.command()
+@click.argument('files', nargs = -1, required = True)
+@click.pass_context
+def estimate(ctx, files):
+    """ Estimate how long G-code files will take to run """
+    import burin.estimate
 
-                for entity in dxf_entities[layer]:
-                    geo.append(entity.render_to_tolerance(loading_params['resolution']))
-            
-            geo = proc.modify_geometry(full_name, geo)
-            optimized = pathcleaner.clean_paths(geo,**gp)
-            for x in proc.generate_code(full_name, optimized):
-                yield x
+    total = 0
+    for path in files:
+        result = burin.estimate.estimate_file(path)
+        total += result['time']
+        print(f"{path}: {burin.estimate.report(result)}")
+    if len(files) > 1:
+        print(f"Total: {burin.estimate.duration(total)}")
 
-    proc.write_file(directory, unit, seg_gen())
-                
-    # After processing the geometry, we may have changed parameters
-    save_blob(directory, state)
-        
 
 @main.command()
 @click.argument('directory')
+@click.argument('source')
+@click.option('--interval', default = 0.2, help = 'How often to check the source file, in seconds')
 @click.pass_context
-def all(ctx, directory):
-    state = get_blob(directory)
-    for stage,_ in sorted(state['stage'].items(), key = lambda x: x[1]):
-        print(f"Processing {stage}")
-        run_unit(stage, directory)
-    
+def watch(ctx, directory, source, interval):
+    """ Keep reprocessing units as the source dxf is re-saved """
+    from burin.pipeline import Pipeline, PipelineError
+
+    with reporting_errors():
+        pipeline = Pipeline.open(directory)
+        pipeline.parameters(prompt = ask)
+
+    seen = None
+    print(f"Watching {source}")
+
+    while True:
+        time.sleep(interval)
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            continue
+        # Wait for the file to stop changing, so we don't read a half-written export
+        current = stat.st_mtime_ns, stat.st_size
+        if current == seen:
+            continue
+        seen = current
+        time.sleep(interval)
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            # Saved by deleting and renaming, and caught in between
+            continue
+        if (stat.st_mtime_ns, stat.st_size) != current:
+            continue
+
+        start = time.perf_counter()
+        try:
+            changed = pipeline.load(source)
+        except PipelineError as e:
+            print(e)
+            continue
+        if changed:
+            print(f"Changed layers: {', '.join(changed)}")
+
+        for u in pipeline.units():
+            try:
+                if not pipeline.run(u):
+                    print(f"Unit {u} is up to date")
+                else:
+                    show_summary(pipeline, u)
+            except (Exception, SystemExit) as e:
+                # Processes sometimes just exit() on bad input - that shouldn't end the watch
+                print(f"Error processing {u}: {e}")
+                break
+        print(f"Done in {time.perf_counter() - start:.2f}s")
+
+
 if __name__ == '__main__':
     main(obj = {})